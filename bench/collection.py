@@ -0,0 +1,176 @@
+from argparse import ArgumentParser
+from itertools import combinations
+from os import makedirs
+from pathlib import Path
+from platform import python_version
+from random import Random
+from re import MULTILINE
+from re import compile
+from re import findall
+from re import sub
+from time import strftime
+
+from ujson import dumps
+
+from bench.frames import measure
+from utils.collection import parse_collection
+from utils.collection import render_clean_ad
+from utils.collection import render_codes
+from utils.series import SeriesCleaner
+
+# Run from the repository root: python -m bench.collection
+
+OPTIONS = ("Remove infrequently used properties", "Clean series names", "Add ticket emoji", "Add gem emoji")
+SIZES = (1, 10, 100, 500)
+TAGS = ("♦️", "🔒", "▫️", "💖", "🛒")
+SERIES = (
+    "Naruto", "One Piece", "Bleach", "Haikyuu!!", "Spy x Family", "Chainsaw Man",
+    "That Time I Got Reincarnated as a Slime Season 2",
+    "The Irregular at Magic High School: Visitor Arc",
+    "My Teen Romantic Comedy SNAFU Climax!",
+    "Is It Wrong to Try to Pick Up Girls in a Dungeon? IV")
+# Exact rules only, the old str.replace cleaning can't express substring rules
+CLEAN_SERIES = {
+    "That Time I Got Reincarnated as a Slime Season 2": "Slime",
+    "The Irregular at Magic High School: Visitor Arc": "Mahouka",
+    "My Teen Romantic Comedy SNAFU Climax!": "Oregairu",
+    "Is It Wrong to Try to Pick Up Girls in a Dungeon? IV": "DanMachi"}
+
+
+# Get Code and Get Clean Ad before cards were parsed into records
+def legacy_codes(collection):
+
+    return ", ".join(findall(r"\*\*`(.{3,6})`\*\*", collection))
+
+
+def legacy_clean_ad(collection):
+
+    return sub(r"`(.+?)`", r"\\``\1`\\`", sub(r"(.*?) (`♡[\d ]{1,5}`)?( · )?(`✧[\d ]{1,3}`)?( · )?\*\*(.+?)\*\* · `([★☆]{4})` · `(.+?)` · `◈(\d)` · (.+?) · \*\*(.+?)\*\*", r"\6 · \2\3\4\5\7 · `◈\9 \8` · \\*\\***\g<11>**\\*\\* · \g<10>", collection))
+
+
+def legacy_select(new_msg, values, clean_series):
+
+    if "Remove infrequently used properties" in values:
+        new_msg = sub(r" · \\``♡([\d ]{1,5})`\\`", "", new_msg)
+        new_msg = sub(r" · \\``✧([\d ]{1,3})`\\`", "", new_msg)
+        new_msg = sub(r" · ([★☆]{4})", "", new_msg)
+
+    if "Clean series names" in values:
+        for series in findall(compile(r".*· (.*)$", MULTILINE), new_msg):
+            if series in clean_series:
+                new_msg = new_msg.replace(series, clean_series[series])
+
+    if "Add ticket emoji" in values:
+        new_msg = sub(compile(r"^(.*)", MULTILINE), r"🎟 \1", new_msg)
+
+    if "Add gem emoji" in values:
+        new_msg = sub(compile(r"^(.*)", MULTILINE), r"💎 \1", new_msg)
+
+    return new_msg
+
+
+def current_select(cards, values, series_cleaner):
+
+    return render_clean_ad(
+        cards,
+        trim="Remove infrequently used properties" in values,
+        series_cleaner=series_cleaner if "Clean series names" in values else None,
+        ticket="Add ticket emoji" in values,
+        gem="Add gem emoji" in values)
+
+
+# Synthetic collection, the part of the description after the header
+def synthetic_collection(size, columns, long_series, seed=0):
+
+    rng = Random(seed)
+    series = SERIES if long_series else SERIES[:6]
+
+    lines = []
+    for i in range(size):
+        properties = []
+        if columns:
+            if rng.random() < 0.8:
+                properties.append(f"`♡{rng.randint(0, 99999)}`")
+            if rng.random() < 0.8:
+                properties.append(f"`✧{rng.randint(0, 999)}`")
+        code = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(rng.choice((4, 5, 6))))
+        properties += [
+            f"**`{code}`**",
+            f"`{''.join(rng.choice('★☆') for _ in range(4))}`",
+            f"`#{rng.randint(1, 999999)}`",
+            f"`◈{rng.randint(1, 4)}`",
+            rng.choice(series),
+            f"**Character {i}**"]
+        lines.append(f"{rng.choice(TAGS)} " + " · ".join(properties))
+
+    return "\n".join(lines)
+
+
+def corpus(corpus_dir):
+
+    collections = {}
+    for size in SIZES:
+        for columns in (False, True):
+            for long_series in (False, True):
+                name = f"synthetic[{size}]{'[columns]' if columns else ''}{'[long_series]' if long_series else ''}"
+                collections[name] = synthetic_collection(size, columns, long_series)
+
+    # Anonymized real descriptions, with the header already stripped
+    if corpus_dir is not None:
+        for path in sorted(Path(corpus_dir).glob("*.txt")):
+            collections[path.stem] = path.read_text(encoding="utf-8")
+
+    return collections
+
+
+def main():
+
+    parser = ArgumentParser(description="Benchmark the Get Code / Get Clean Ad collection parser")
+    parser.add_argument("--corpus", default=None, help="directory of anonymized collection descriptions (.txt)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", default=f"bench/results/collection_{strftime('%Y%m%d_%H%M%S')}.json")
+    args = parser.parse_args()
+
+    series_cleaner = SeriesCleaner(CLEAN_SERIES)
+    option_sets = [()] + [values for count in range(1, 4) for values in combinations(OPTIONS, count)]
+    results = {}
+
+    def run(name, func):
+        results[name] = measure(func, args.iterations)
+        print(f"{name: <72} p50 {results[name]['p50_ms']: >8.3f} ms   "
+              f"{results[name]['ops_per_core']: >10.1f} ops/s/core")
+
+    for name, collection in corpus(args.corpus).items():
+
+        cards = parse_collection(collection)
+        legacy = legacy_clean_ad(collection)
+
+        # Both implementations must agree before their speed means anything
+        assert render_codes(cards) == legacy_codes(collection), f"{name}: codes differ"
+        for values in option_sets:
+            expected = legacy_select(legacy, values, CLEAN_SERIES) if values else legacy
+            assert current_select(cards, values, series_cleaner) == expected, f"{name}: {values} differ"
+
+        run(f"parse[{name}]", lambda: parse_collection(collection))
+        run(f"codes[{name}]", lambda: render_codes(parse_collection(collection)))
+        run(f"legacy_codes[{name}]", lambda: legacy_codes(collection))
+
+        for values in option_sets:
+            label = "+".join(str(OPTIONS.index(value)) for value in values) or "none"
+            run(f"clean_ad[{name}][{label}]",
+                lambda: current_select(parse_collection(collection), values, series_cleaner))
+            run(f"legacy_clean_ad[{name}][{label}]",
+                lambda: legacy_select(legacy_clean_ad(collection), values, CLEAN_SERIES))
+
+    makedirs(Path(args.output).parent, exist_ok=True)
+    with open(args.output, "w") as output_file:
+        output_file.write(dumps({
+            "time": strftime("%Y-%m-%d %H:%M:%S"),
+            "python": python_version(),
+            "options": OPTIONS,
+            "results": results}, indent=2))
+    print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+from argparse import ArgumentParser
+from io import BytesIO
+from os import makedirs
+from pathlib import Path
+from platform import python_version
+from resource import RUSAGE_SELF
+from resource import getrusage
+from statistics import quantiles
+from sys import platform
+from time import perf_counter
+from time import strftime
+
+from numpy import arange
+from numpy import array_equal
+from numpy import asarray
+from numpy import dstack
+from numpy import uint8
+from numpy.random import default_rng
+from PIL import Image
+from PIL import __version__ as pillow_version
+from ujson import dumps
+
+from utils.composite import CHARACTER
+from utils.composite import composite_frames
+from utils.composite import composite_frames_pillow
+from utils.composite import prepare_frame
+from utils.images import load_frame
+from utils.render import PLACEMENT
+from utils.render import SIZE
+
+# Run from the repository root: python -m bench.frames
+
+
+# Synthetic character art, roughly the size Karuta serves
+def fixture_characters():
+
+    rng = default_rng(0)
+    gradient = (arange(274 * 400).reshape(400, 274) % 256).astype(uint8)
+    noise = rng.integers(0, 256, (400, 274, 3), dtype=uint8)
+
+    characters = {}
+    for name, array in (("gradient", dstack((gradient, gradient[::-1], 255 - gradient))),
+                        ("noise", noise)):
+        buffer = BytesIO()
+        Image.fromarray(array, "RGB").save(buffer, format="PNG")
+        characters[name] = buffer.getvalue()
+
+    return characters
+
+
+def measure(func, iterations, warmup=2):
+
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(iterations):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+
+    percentiles = quantiles(timings, n=100, method="inclusive")
+    return {
+        "iterations": iterations,
+        "p50_ms": percentiles[49] * 1000,
+        "p95_ms": percentiles[94] * 1000,
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        # Everything runs on one thread, so this is throughput per core
+        "ops_per_core": len(timings) / sum(timings)}
+
+
+def encode(image, file_format):
+
+    buffer = BytesIO()
+    image.save(buffer, format=file_format)
+    return buffer.getvalue()
+
+
+def main():
+
+    parser = ArgumentParser(description="Benchmark the Test Frames On rendering pipeline")
+    parser.add_argument("--frames", default="data/frames", help="directory of frame PNGs")
+    parser.add_argument("--characters", nargs="*", default=[], help="character images, synthetic if empty")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--output", default=f"bench/results/frames_{strftime('%Y%m%d_%H%M%S')}.json")
+    args = parser.parse_args()
+
+    urls = sorted(path.stem for path in Path(args.frames).glob("*.png"))[:10]
+    if len(urls) == 0:
+        parser.error(f"no frame PNGs found in {args.frames}")
+    if len(urls) < 10:
+        print(f"Only {len(urls)} frames found, reusing them to fill 10 cells")
+        urls = (urls * 10)[:10]
+
+    if args.characters:
+        characters = {Path(path).stem: Path(path).read_bytes() for path in args.characters}
+    else:
+        characters = fixture_characters()
+
+    frames = [load_frame(url) for url in urls]
+    frame_arrays = [prepare_frame(frame) for frame in frames]
+    results = {}
+
+    def run(name, func):
+        results[name] = measure(func, args.iterations)
+        print(f"{name: <32} p50 {results[name]['p50_ms']: >8.2f} ms   p95 {results[name]['p95_ms']: >8.2f} ms   "
+              f"{results[name]['ops_per_core']: >8.1f} ops/s/core")
+
+    run("decode_frame_png", lambda: load_frame(urls[0]))
+    run("prepare_frame", lambda: prepare_frame(frames[0]))
+
+    for character_name, character in characters.items():
+
+        run(f"decode_character[{character_name}]", lambda: Image.open(BytesIO(character)).load())
+        decoded = Image.open(BytesIO(character))
+        decoded.load()
+        run(f"resize_character[{character_name}]", lambda: decoded.resize(CHARACTER))
+        resized = decoded.resize(CHARACTER)
+
+        for count in range(1, 11):
+            size = SIZE[count - 1]
+            placement = PLACEMENT[:count]
+
+            # Both implementations must agree before their speed means anything
+            assert array_equal(
+                asarray(composite_frames(resized, frame_arrays[:count], size, placement)),
+                asarray(composite_frames_pillow(resized, frames[:count], size, placement))), \
+                f"{character_name}: {count} frames differ"
+
+            run(f"composite_numpy[{character_name}][{count}]",
+                lambda: composite_frames(resized, frame_arrays[:count], size, placement))
+            run(f"composite_pillow[{character_name}][{count}]",
+                lambda: composite_frames_pillow(resized, frames[:count], size, placement))
+
+        grid = composite_frames(resized, frame_arrays, SIZE[9], PLACEMENT)
+        run(f"encode_jpeg[{character_name}]", lambda: encode(grid, "JPEG"))
+        run(f"encode_png[{character_name}]", lambda: encode(grid, "PNG"))
+
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak_rss = getrusage(RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / 1048576 if platform == "darwin" else peak_rss / 1024
+    print(f"Peak RSS: {peak_rss_mb:.1f} MiB")
+
+    makedirs(Path(args.output).parent, exist_ok=True)
+    with open(args.output, "w") as output_file:
+        output_file.write(dumps({
+            "time": strftime("%Y-%m-%d %H:%M:%S"),
+            "python": python_version(),
+            "pillow": pillow_version,
+            "frames": urls,
+            "characters": list(characters),
+            "peak_rss_mb": peak_rss_mb,
+            "results": results}, indent=2))
+    print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,8 @@ from utils.db import awrite_json
 from utils.logger import get_log_decorator
 
 log_as = get_log_decorator(getLogger(__name__))
+clan_cog = "clan"
+frame_cog = "frame"
 utility_cog = "Utility"
 
 
@@ -31,14 +33,16 @@ class Admin(Cog):
     clean_series = Group(name="series", description="...", parent=clean)
 
     @clean_series.command(name="add", description="Add to clean series list")
-    @describe(before="Series to replace", after="Series replaced with")
+    @describe(before="Series to replace, start with * to replace it inside any series", after="Series replaced with")
     @check(cog_check_admin)
     @log_as("/clean series add")
     async def clean_series_add(self, interaction: Interaction, before: str, after: str):
 
-        clean_series = self.bot.cogs[utility_cog].clean_series
+        series_cleaner = self.bot.cogs[utility_cog].series_cleaner
+        clean_series = series_cleaner.clean_series
 
         clean_series[before] = after
+        series_cleaner.build(clean_series)
         await awrite_json("clean_series", clean_series, sort=True)
         await interaction.response.send_message(
             f"{interaction.user.mention}, successfully added:\n" +
@@ -50,7 +54,7 @@ class Admin(Cog):
     @log_as("/clean series refresh")
     async def clean_series_refresh(self, interaction: Interaction):
 
-        self.bot.cogs[utility_cog].clean_series = await aread_json("clean_series")
+        self.bot.cogs[utility_cog].series_cleaner.build(await aread_json("clean_series"))
         await interaction.response.send_message(f"{interaction.user.mention}, successfully refreshed.")
 
     @clean_series.command(name="delete", description="Delete clean series list")
@@ -59,7 +63,8 @@ class Admin(Cog):
     @log_as("/clean series delete")
     async def clean_series_delete(self, interaction: Interaction, series: str):
 
-        clean_series = self.bot.cogs[utility_cog].clean_series
+        series_cleaner = self.bot.cogs[utility_cog].series_cleaner
+        clean_series = series_cleaner.clean_series
         ping = interaction.user.mention
         reply = interaction.response.send_message
 
@@ -70,6 +75,7 @@ class Admin(Cog):
             await reply(f"{ping}, no series found named `{series}`.")
 
         else:
+            series_cleaner.build(clean_series)
             await awrite_json("clean_series", clean_series)
             await reply(f"{ping}, successfully deleted `{series}`.")
 
@@ -78,9 +84,25 @@ class Admin(Cog):
     @log_as("/info")
     async def info(self, interaction: Interaction):
 
+        cache = self.bot.cogs[frame_cog].renderer.stats()
+        collections = self.bot.cogs[utility_cog].collections.stats()
+        clans = self.bot.cogs[clan_cog].clans.stats()
+        clan_db = self.bot.cogs[clan_cog].db.stats()
         await interaction.response.send_message(
             embed=Embed(
                 title="Bot Info",
                 description=f"**Username:** {self.bot.user}\n**User ID:** {self.bot.user.id}\n**Guild Count**: " +
-                            f"{len(self.bot.guilds)}",),
+                            f"{len(self.bot.guilds)}\n**Frame Atlas:** {cache['atlas_frames']} frames, " +
+                            f"{cache['atlas_bytes'] / 1048576:.1f} MiB, {cache['atlas_reads']} reads, " +
+                            f"{cache['atlas_fallbacks']} fallbacks\n**Frame Cache:** {cache['frame_entries']} " +
+                            f"frames, {cache['frame_bytes'] / 1048576:.1f} MiB, {cache['frame_hits']} hits, " +
+                            f"{cache['frame_misses']} misses\n**Render Jobs:** {cache['jobs']}/" +
+                            f"{cache['max_jobs']} on {cache['workers']} workers\n" +
+                            f"**Render Cache:** {cache['result_entries']} renders, {cache['result_hits']} hits, " +
+                            f"{cache['result_misses']} misses\n**Collection Cache:** {collections['entries']}/" +
+                            f"{collections['max_entries']} collections, {collections['hit_rate']:.0%} hit rate\n" +
+                            f"**Clan Cache:** {clans['clans']} clans in {clans['guilds']} servers, " +
+                            f"{clans['hit_rate']:.0%} hit rate\n**Clan Database:** " +
+                            f"{clan_db['readers'] - clan_db['idle_readers']}/{clan_db['readers']} readers busy, " +
+                            f"{clan_db['waiting_reads']} reads waiting, {clan_db['queued_writes']} writes queued",),
             ephemeral=True)
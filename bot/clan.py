@@ -15,11 +15,11 @@ from discord.app_commands import command
 from discord.app_commands import describe
 from discord.app_commands.checks import has_permissions
 from discord.ext.commands import GroupCog
-from discord.ext.tasks import loop
 from discord.ui import View
 from discord.ui import button
 
 from utils.checks import is_card_embed
+from utils.clans import ClanCache
 from utils.db import SQLite3
 from utils.logger import get_log_decorator
 from utils.views import ConfirmView
@@ -37,41 +37,25 @@ class Clan(GroupCog, name="clan", description="Collection of commmands to help w
 
         self.bot = bot
         self.db = SQLite3()
-        self.db_commit_task.start()
+        self.clans = ClanCache(self.db)
 
     async def cog_load(self):
 
+        # Also brings the schema up to date
         await self.db.connect("clanverify")
-        await self.db.execute("""
-        CREATE TABLE IF NOT EXISTS clanverify (
-            id INTEGER PRIMARY KEY, 
-            guild_id INTEGER,
-            general_role_1 INTEGER,
-            general_role_2 INTEGER,
-            tairo_role INTEGER,
-            roju_role INTEGER,
-            ometsuke_role INTEGER,
-            daimyo_role INTEGER,
-            gundai_role INTEGER,
-            monogashiro_role INTEGER,
-            ashigaru_role INTEGER,
-            chonin_role INTEGER)""")
+        await self.clans.warm()
 
     async def cog_unload(self):
 
         await self.db.close()
 
-    @loop(seconds=0.05)
-    async def db_commit_task(self):
-        await self.db.commit()
-
     @command(name="info", description="Shows information about the clans in the server")
     @log_as("/clan info")
     async def clan_info(self, interaction: Interaction):
 
         ping = interaction.user.mention
         reply = interaction.response.send_message
-        data = await self.db.execute(f"SELECT * FROM clanverify WHERE guild_id = {interaction.guild_id}", fetch="all")
+        data = await self.clans.get_guild(interaction.guild_id)
 
         if len(data) == 0:
             await reply(ping, embed=Embed(
@@ -183,7 +167,7 @@ class Clan(GroupCog, name="clan", description="Collection of commmands to help w
 
         ping = interaction.user.mention
         reply = interaction.response.send_message
-        data = await self.db.get_key("clanverify", interaction.user.id)
+        data = await self.clans.get_shogun(interaction.user.id)
 
         if data is None:
             await reply(f"{ping}, clan verification is not enabled for this server.")
@@ -232,10 +216,9 @@ class Clan(GroupCog, name="clan", description="Collection of commmands to help w
 
         shogun = int(shogun)
 
-        data = await self.db.execute(f"SELECT * FROM clanverify "
-                                     f"WHERE id = {shogun} AND guild_id = {interaction.guild_id}", fetch="one")
+        data = await self.clans.get_shogun(shogun)
 
-        if data is None:
+        if data is None or data[1] != interaction.guild_id:
             await reply(f"{ping}, no clan registered in this server under shogun ID `{shogun}`.")
 
         else:
@@ -292,7 +275,7 @@ class Clan(GroupCog, name="clan", description="Collection of commmands to help w
         reply = interaction.response.send_message
         ping = interaction.user.mention
 
-        data = await self.db.get_key("clanverify", interaction.user.id)
+        data = await self.clans.get_shogun(interaction.user.id)
 
         # Check is already have a clan verify in another server
         if data is not None:
@@ -308,7 +291,7 @@ class Clan(GroupCog, name="clan", description="Collection of commmands to help w
                 return
 
         # Check if reached max server count
-        data = await self.db.execute(f"SELECT * FROM clanverify WHERE guild_id = {interaction.guild_id}", fetch="all")
+        data = await self.clans.get_guild(interaction.guild_id)
         for entry in data:
             if entry[0] == interaction.user.id:
                 data.remove(entry)
@@ -325,9 +308,10 @@ class Clan(GroupCog, name="clan", description="Collection of commmands to help w
                         "server needs more, please contact `PixellProton#8577`.")
             return
 
-        # Check roles
-        for role in (general_role_1, general_role_2, tairo_role, roju_role, ometsuke_role, daimyo_role, gundai_role,
-                     monogashiro_role, ashigaru_role, chonin_role):
+        # Check roles, in rank order
+        roles = (general_role_1, general_role_2, tairo_role, roju_role, ometsuke_role, daimyo_role, gundai_role,
+                 monogashiro_role, ashigaru_role, chonin_role)
+        for role in roles:
             if role is not None:
                 if not role.is_assignable():
                     await reply(f"{ping}, the bot does not have the permissions to give the `{role.name}` role. " +
@@ -335,20 +319,28 @@ class Clan(GroupCog, name="clan", description="Collection of commmands to help w
                                 f"`{role.name}` role.")
                     return
 
-        # Add to database
-        await self.db.set_key(
-            "clanverify", interaction.user.id,
-            guild_id=interaction.guild_id,
-            general_role_1=general_role_1.id if general_role_1 is not None else 0,
-            general_role_2=general_role_2.id if general_role_2 is not None else 0,
-            tairo_role=tairo_role.id if tairo_role is not None else 0,
-            roju_role=roju_role.id if roju_role is not None else 0,
-            ometsuke_role=ometsuke_role.id if ometsuke_role is not None else 0,
-            daimyo_role=daimyo_role.id if daimyo_role is not None else 0,
-            gundai_role=gundai_role.id if gundai_role is not None else 0,
-            monogashiro_role=monogashiro_role.id if monogashiro_role is not None else 0,
-            ashigaru_role=ashigaru_role.id if ashigaru_role is not None else 0,
-            chonin_role=chonin_role.id if chonin_role is not None else 0)
+        # Add to database, checking again inside the transaction so concurrent setups can't both pass
+        async with self.db.transaction() as transaction:
+            data = await transaction.get_key("clanverify", interaction.user.id)
+            clan_count = (await transaction.execute(
+                "SELECT COUNT(*) FROM clanverify WHERE guild_id = ? AND id != ?",
+                (interaction.guild_id, interaction.user.id), fetch="one"))[0]
+            conflict = data is not None and data[1] != interaction.guild_id or clan_count >= max_clans
+
+            if not conflict:
+                await transaction.set_key("clanverify", interaction.user.id, guild_id=interaction.guild_id)
+                await transaction.execute(
+                    "DELETE FROM clanroles WHERE clan_id = ?", (interaction.user.id,),
+                    changed=("clanroles", interaction.user.id))
+                for rank, role in enumerate(roles):
+                    if role is not None:
+                        await transaction.execute(
+                            "INSERT INTO clanroles (clan_id, rank, role_id) VALUES (?, ?, ?)",
+                            (interaction.user.id, rank, role.id), changed=("clanroles", interaction.user.id))
+
+        if conflict:
+            await reply(f"{ping}, another clan was set up in this server at the same time, please try again.")
+            return
 
         # Send result
         embed = Embed(
@@ -405,7 +397,7 @@ class Clan(GroupCog, name="clan", description="Collection of commmands to help w
 
         ping = interaction.user.mention
         reply = interaction.response.send_message
-        clans = await self.db.execute(f"SELECT * FROM clanverify WHERE guild_id = {interaction.guild_id}", fetch="all")
+        clans = await self.clans.get_guild(interaction.guild_id)
 
         if len(clans) is None:
             await reply(f"{ping}, there are no clans setup in this server.")
@@ -417,14 +409,13 @@ class Clan(GroupCog, name="clan", description="Collection of commmands to help w
             await reply(f"{ping}, please do `k!clanview` (commonly `kcv`).")
 
             def message_check(message_: Message):
-                if message_.channel.id == interaction.channel_id:
-                    if is_card_embed("View Clan", message_):
-                        return message_.embeds[0].description[27:45] == str(interaction.user.id)
+                if is_card_embed("View Clan", message_):
+                    return message_.embeds[0].description[27:45] == str(interaction.user.id)
                 return False
 
             # Check for user's kcv message
             try:
-                message = await self.bot.wait_for("message", timeout=30, check=message_check)
+                message = await self.bot.router.wait_for(interaction.channel_id, timeout=30, check=message_check)
             except TimeoutError:
                 return
 
@@ -1,12 +1,10 @@
 from asyncio import TimeoutError
 from io import BytesIO
 from logging import getLogger
-from os import remove
 from pathlib import Path
 from string import capwords as title
 from typing import Optional
 
-from PIL import Image
 from discord import Attachment
 from discord import Colour
 from discord import Embed
@@ -21,33 +19,169 @@ from discord.app_commands import guilds
 from discord.app_commands import rename
 from discord.app_commands.checks import cooldown
 from discord.ext.commands import GroupCog
+from discord.ext.tasks import loop
 from discord.ui import View
 from discord.ui import button
-from requests import get
 
 from env import guild
 from utils.checks import cog_check_admin
 from utils.checks import is_card_embed
-from utils.db import awrite_json
-from utils.db import read_json
+from utils.fetch import FetchError
+from utils.fetch import ImageFetcher
+from utils.frames import FrameCatalogue
+from utils.frames import FrameJournal
 from utils.logger import get_log_decorator
+from utils.render import RenderEngine
+from utils.render import RenderQueueFull
 
-all_frames = read_json("frames")
+frame_journal = FrameJournal()
+all_frames = FrameCatalogue(frame_journal.load())
 log_as = get_log_decorator(getLogger(__name__))
 
 
-def filter_frames(possible_tags: str, frames: list):
+class FrameShopSession:
 
-    # Loop through all frames
-    new_frames = [frame for frame in frames if
-                  # Check if all tag words in the tag phrase
-                  all((word.lower() in frame["tags"]) for word in possible_tags.split())]
+    __slots__ = ("user_id", "frames", "index", "detailed_mode", "corrected")
 
-    # Invalid tag
-    if len(new_frames) == 0:
-        return False, frames
+    def __init__(self, user_id, frames):
 
-    return True, new_frames
+        self.user_id = user_id
+        # Frame ids into the shared catalogue
+        self.frames = frames
+        self.index = 0
+        self.detailed_mode = True
+        # Tags actually searched when the user's tags had typos
+        self.corrected = None
+
+    def move(self, step):
+
+        self.index = (self.index + step) % len(self.frames)
+
+    def reset(self):
+
+        self.frames = all_frames.ordered
+        self.index = 0
+        self.corrected = None
+
+    def filter(self, possible_tags: str):
+
+        tags = all_frames.correct(possible_tags)
+        valid_tag, possible_frames = all_frames.filter_ids(tags)
+
+        if valid_tag:
+            self.frames = possible_frames
+            self.index = 0
+            self.corrected = tags if tags != " ".join(possible_tags.lower().split()) else None
+
+        return valid_tag
+
+    def message_check(self, message: Message):
+
+        # Ignore pings from the bot
+        if message.author.id != self.user_id:
+            return False
+
+        return self.filter(message.content)
+
+    def get_embed(self):
+
+        frames = self.frames
+        index = self.index
+        frame_id = frames[index]
+        names = all_frames.names
+
+        if self.detailed_mode:
+
+            if len(frames) == 1:
+                select = ["", "", f"   1. {names[frame_id]}", "", ""]
+
+            elif len(frames) == 2:
+                select = ["", "", f"   1. {names[frame_id]}", f"   2. {names[frames[1]]}", ""]
+                if index == 1:
+                    select.append(select.pop(0))
+
+            elif len(frames) == 3:
+                select = ["", "", f"   1. {names[frame_id]}", f"   2. {names[frames[1]]}",
+                          f"   3. {names[frames[2]]}"]
+                for i in range(index):
+                    select.append(select.pop(0))
+
+            elif len(frames) == 3:
+                select = [f"   4. {names[frames[3]]}", "", f"   1. {names[frame_id]}",
+                          f"   2. {names[frames[1]]}", f"   3. {names[frames[2]]}"]
+                for i in range(index):
+                    select.append(select.pop(0))
+
+            else:
+
+                indexes = [index_ % len(frames) for index_ in range(index - 2, index + 3)]
+                # Assemble frame list
+                select = [f" {indexes[i] + 1: >3}. {names[frames[indexes[i]]]}" for i in range(5)]
+
+            # Finalize block
+            select = [(">" if i == 2 else "-") + select[i] for i in range(5)]
+            select.insert(2, "")
+            select.insert(4, "")
+            select = "\n".join(f"{line: <27}" if line not in ("-", "") else line for line in select)
+
+            embed = Embed(
+                title="Frame Shop",
+                description=f"**Information**\n```md\n{all_frames.info[frame_id]}\n```\n**Selection**\n"
+                            f"```c\n{select}\n```",
+                colour=Colour.light_grey())
+            embed.set_thumbnail(url=all_frames.images[frame_id])
+
+        else:
+
+            embed = Embed(
+                title="Frame Shop",
+                description=f"{names[frame_id]} Frame",
+                colour=Colour.light_grey())
+            embed.set_image(url=all_frames.images[frame_id])
+
+        if self.corrected is None:
+            embed.set_footer(text="Type a tag to filter the frames")
+        else:
+            embed.set_footer(text=f"Showing results for: {self.corrected}")
+
+        return embed
+
+
+class FrameShopView(View):
+
+    def __init__(self, session: FrameShopSession):
+        super().__init__(timeout=30)
+        self.session = session
+
+    @button(emoji="🔼", row=0)
+    async def button_s1(self, interaction_: Interaction, _):
+        self.session.move(-1)
+        await interaction_.response.edit_message(embed=self.session.get_embed())
+
+    @button(emoji="🔽", row=1)
+    async def button_a1(self, interaction_: Interaction, _):
+        self.session.move(1)
+        await interaction_.response.edit_message(embed=self.session.get_embed())
+
+    @button(emoji="⏫", row=0)
+    async def button_s5(self, interaction_: Interaction, _):
+        self.session.move(-5)
+        await interaction_.response.edit_message(embed=self.session.get_embed())
+
+    @button(emoji="⏬", row=1)
+    async def button_a5(self, interaction_: Interaction, _):
+        self.session.move(5)
+        await interaction_.response.edit_message(embed=self.session.get_embed())
+
+    @button(emoji="🔄", row=0)
+    async def button_reset(self, interaction_: Interaction, _):
+        self.session.reset()
+        await interaction_.response.edit_message(embed=self.session.get_embed())
+
+    @button(emoji="🔍", row=1)
+    async def button_change_mode(self, interaction_: Interaction, _):
+        self.session.detailed_mode = not self.session.detailed_mode
+        await interaction_.response.edit_message(embed=self.session.get_embed())
 
 
 async def setup(bot):
@@ -71,10 +205,30 @@ class Frame(GroupCog, name="frame", description="Collection of commmands to help
             self.context_menus.append(context_menu)
 
         self.active_frametest = {}
+        self.renderer = RenderEngine()
+        self.fetcher = ImageFetcher()
+        self.frame_compact_task.start()
+
+    async def cog_load(self) -> None:
+
+        # Frame tests left behind by the old render path
+        for file in Path("data/temp").glob("frame_test_*.jpg"):
+            file.unlink(missing_ok=True)
+
+        await self.renderer.build_atlas([frame["url"] for frame in all_frames.frames])
 
     async def cog_unload(self) -> None:
         for context_menu in self.context_menus:
             self.bot.tree.remove_command(context_menu.name, type=context_menu.type)
+        self.renderer.close()
+        await self.fetcher.close()
+        self.frame_compact_task.cancel()
+        await frame_journal.compact(all_frames.all())
+
+    # Fold frames added since the last snapshot into a new one
+    @loop(minutes=1)
+    async def frame_compact_task(self):
+        await frame_journal.compact(all_frames.all())
 
     @command(name="add", description="Add frame to database")
     @describe(name="Frame name", group="Bit / Gem / Special / Valentines / Springtide / Halloween / Festivus",
@@ -93,8 +247,6 @@ class Frame(GroupCog, name="frame", description="Collection of commmands to help
             url: Optional[str]
     ):
 
-        global all_frames
-
         # Generate tags
         group = group.replace("bit", "bit basic").replace("gem", "gem carousel") \
             .replace("valentines", "event valentines valentine") \
@@ -112,18 +264,18 @@ class Frame(GroupCog, name="frame", description="Collection of commmands to help
 
         # Save data to file and frame cog
         frame = dict(name=name, tags=tags, url=url)
-        all_frames.append(frame)
-        all_frames = sorted(all_frames, key=lambda x: x["name"])
+        frame_id = all_frames.add(frame)
 
-        await awrite_json("frames", all_frames)
+        await frame_journal.append(frame)
         await img.save(Path(f"data/frames/{url}.png"))
+        await self.renderer.update_atlas(url)
 
         # Send message
         embed = Embed(
             title=f"{title(name)} Frame",
             description=f"**URL:** {url}\n**Tags:** {', '.join(tags)}",
             colour=Colour.light_grey())
-        embed.set_image(url=f"https://d2l56h9h5tj8ue.cloudfront.net/images/frames/frame-{url}.jpg")
+        embed.set_image(url=all_frames.images[frame_id])
         await interaction.response.send_message("Successfully added:", embed=embed)
 
     @command(name="shop", description="Custom frame shop with all frames")
@@ -133,184 +285,25 @@ class Frame(GroupCog, name="frame", description="Collection of commmands to help
     @log_as("/frame shop")
     async def frame_shop(self, interaction: Interaction, options: Optional[str]):
 
-        frames = all_frames.copy()
-        index = 0
-        detailed_mode = True
+        session = FrameShopSession(interaction.user.id, all_frames.ordered)
 
         if options is not None:
-            frames = filter_frames(options, frames)[1]
-
-        # For view reset
-        def reset_frames():
-            nonlocal frames
-            frames = all_frames.copy()
-
-        class FrameShopView(View):
-
-            def __init__(self):
-                super().__init__(timeout=30)
-
-            @button(emoji="🔼", row=0)
-            async def button_s1(self, interaction_: Interaction, _):
-
-                nonlocal index
-
-                index = (index - 1) % len(frames)
-                await interaction_.response.edit_message(embed=get_embed())
-
-            @button(emoji="🔽", row=1)
-            async def button_a1(self, interaction_: Interaction, _):
+            session.filter(options)
 
-                nonlocal index
-
-                index = (index + 1) % len(frames)
-                await interaction_.response.edit_message(embed=get_embed())
-
-            @button(emoji="⏫", row=0)
-            async def button_s5(self, interaction_: Interaction, _):
-
-                nonlocal index
-
-                index = (index - 5) % len(frames)
-                await interaction_.response.edit_message(embed=get_embed())
-
-            @button(emoji="⏬", row=1)
-            async def button_a5(self, interaction_: Interaction, _):
-
-                nonlocal index
-
-                index = (index + 5) % len(frames)
-                await interaction_.response.edit_message(embed=get_embed())
-
-            @button(emoji="🔄", row=0)
-            async def button_reset(self, interaction_: Interaction, _):
-
-                nonlocal index
-
-                reset_frames()
-                index = 0
-                await interaction_.response.edit_message(embed=get_embed())
-
-            @button(emoji="🔍", row=1)
-            async def button_change_mode(self, interaction_: Interaction, _):
-
-                nonlocal detailed_mode
-
-                detailed_mode = not detailed_mode
-                await interaction_.response.edit_message(embed=get_embed())
-
-        def get_embed():
-
-            frame = frames[index]
-
-            if detailed_mode:
-
-                if len(frames) == 1:
-                    select = ["", "", f"   1. {title(frame['name'])}", "", ""]
-
-                elif len(frames) == 2:
-                    select = ["", "", f"   1. {title(frame['name'])}", f"   2. {title(frames[1]['name'])}", ""]
-                    if index == 1:
-                        select.append(select.pop(0))
-
-                elif len(frames) == 3:
-                    select = ["", "", f"   1. {title(frame['name'])}", f"   2. {title(frames[1]['name'])}",
-                              f"   3. {title(frames[2]['name'])}"]
-                    for i in range(index):
-                        select.append(select.pop(0))
-
-                elif len(frames) == 3:
-                    select = [f"   4. {title(frames[3]['name'])}", "", f"   1. {title(frame['name'])}",
-                              f"   2. {title(frames[1]['name'])}", f"   3. {title(frames[2]['name'])}"]
-                    for i in range(index):
-                        select.append(select.pop(0))
-
-                else:
-
-                    indexes = [index_ % len(frames) for index_ in range(index - 2, index + 3)]
-                    # Assemble frame list
-                    select = [f" {indexes[i] + 1: >3}. {title(frames[indexes[i]]['name'])}" for i in range(5)]
-
-                # Finalize block
-                select = [(">" if i == 2 else "-") + select[i] for i in range(5)]
-                select.insert(2, "")
-                select.insert(4, "")
-
-                tags = frame['tags']
-                if "bit" in tags:
-                    basic_index = tags.index("basic")
-                    info = ["# Type:", "- Basic / Bit",
-                            "# Cost:", f"- 2500 {tags[basic_index + 1]} bits\n- 2500 {tags[basic_index + 2]} bits"]
-                elif "gem" in tags:
-                    info = ["# Type:", "- Carousel / Gem", "# Cost:", "- 1000 gems (in rotation)"]
-                elif "special" in tags:
-                    info = ["# Type:", "- Special", "# Cost:", "- Special Frames Box"]
-
-                else:
-                    event_index = tags.index("event")
-                    # Does not container an alias (e.g. springtide spring)
-                    if "halloween" in tags or "festivus" in tags:
-                        info = ["# Type:", f"- Event / {title(tags[event_index + 1])} {tags[event_index + 2]}",
-                                "# Cost:", "- During event only"]
-                    else:
-                        info = ["# Type:", f"- Event / {title(tags[event_index + 1])} {tags[event_index + 3]}",
-                                "# Cost:", "- During event only"]
-
-                info = "\n".join(f"{line: <27}" for line in info)
-                select = "\n".join(f"{line: <27}" if line not in ("-", "") else line for line in select)
-
-                embed = Embed(
-                    title="Frame Shop",
-                    description=f"**Information**\n```md\n{info}\n```\n**Selection**\n```c\n{select}\n```",
-                    colour=Colour.light_grey())
-                embed.set_thumbnail(
-                    url=f"https://d2l56h9h5tj8ue.cloudfront.net/images/frames/frame-{frames[index]['url']}.jpg")
-
-            else:
-
-                embed = Embed(
-                    title="Frame Shop",
-                    description=f"{title(frame['name'])} Frame",
-                    colour=Colour.light_grey())
-                embed.set_image(
-                    url=f"https://d2l56h9h5tj8ue.cloudfront.net/images/frames/frame-{frames[index]['url']}.jpg")
-
-            embed.set_footer(text="Type a tag to filter the frames")
-
-            return embed
-
-        await interaction.response.send_message(interaction.user.mention, embed=get_embed(), view=FrameShopView())
-
-        def message_check(message_: Message):
-
-            # Incorrect server
-            if message_.author.id != interaction.user.id and message_.channel.id != interaction.channel_id:
-                return False
-            if message_.author.id == self.bot.user.id and message_.channel.id == interaction.channel_id and \
-                    message_.content[2:20] == str(interaction.user.id):
-                return False
-
-            nonlocal frames, index
-            valid_tag, possible_frames = filter_frames(message_.content, all_frames.copy())
-
-            if valid_tag:
-                frames = possible_frames
-                index = 0
-
-            return valid_tag
+        await interaction.response.send_message(
+            interaction.user.mention, embed=session.get_embed(), view=FrameShopView(session))
 
         while True:
 
             try:
-                message = await self.bot.wait_for("message", timeout=60, check=message_check)
-                if message.author.id == self.bot.user.id:
-                    break
+                await self.bot.router.wait_for(
+                    interaction.channel_id, interaction.user.id, timeout=60, check=session.message_check)
 
             except TimeoutError:
                 break
 
             else:
-                await interaction.edit_original_message(embed=get_embed())
+                await interaction.edit_original_message(embed=session.get_embed())
 
     @command(name="tags", description="List of tags for frame commands")
     @log_as("/frame tags")
@@ -349,50 +342,47 @@ class Frame(GroupCog, name="frame", description="Collection of commmands to help
 
         await interaction.response.send_message(f"{ping}, please enter the tags of the frame(s) you want to test.")
 
-        def message_check(message_: Message):
-            return (message_.author.id == interaction.user.id and message_.channel.id == interaction.channel.id) or \
-                   (message_.author.id == self.bot.user.id and message_.channel.id == interaction.channel.id and
-                    message_.content[2:20] == str(interaction.user.id))
-
+        # Either the user's tags or a new command pinging the user
         try:
-            tag_message = await self.bot.wait_for("message", timeout=45, check=message_check)
+            tag_message = await self.bot.router.wait_for(interaction.channel_id, interaction.user.id, timeout=45)
             if tag_message.author.id == self.bot.user.id:
                 return
         except TimeoutError:
             return
 
-        success, frames = filter_frames(tag_message.content, all_frames.copy())
+        success, frames = all_frames.filter(all_frames.correct(tag_message.content))
 
         if not success:
-            await tag_message.reply("Invalid tags.")
+            suggestions = all_frames.suggest(tag_message.content)
+            if len(suggestions) != 0:
+                await tag_message.reply(f"Invalid tags, did you mean: {', '.join(suggestions)}?")
+            else:
+                await tag_message.reply("Invalid tags.")
 
         frames = frames[:10]
-        placement = ((0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1), (3, 0), (3, 1), (4, 0), (4, 1))[:len(frames)]
-        size = ((1, 1), (2, 1), (3, 1), (3, 2), (3, 2), (3, 2), (4, 2), (4, 2), (5, 2), (5, 2))[len(frames) - 1]
-        if message.embeds[0].thumbnail.url is not None:
-            character = Image.open(BytesIO(get(message.embeds[0].thumbnail.url).content))
-        else:
-            character = Image.open(BytesIO(get(message.embeds[0].image.url).content))
+        try:
+            if message.embeds[0].thumbnail.url is not None:
+                digest, character = await self.fetcher.fetch(message.embeds[0].thumbnail.url)
+            else:
+                digest, character = await self.fetcher.fetch(message.embeds[0].image.url)
+        except FetchError:
+            await tag_message.reply("Could not download the character image, please try again.")
+            return
 
-        character = character.resize((319, 441))
         file_name = f"frame_test_{interaction.user.id}_{round(interaction.created_at.timestamp())}.jpg"
-        file_path = f"data/temp/{file_name}"
-        result = Image.new("RGB", (size[0] * 381, size[1] * 570), (46, 49, 54))
 
-        for i in range(len(frames)):
-            frame = Image.open(f"data/frames/{frames[i]['url']}.png")
-            framed_character = Image.new("RGB", (381, 570))
-            framed_character.paste(character, (31, 76))
-            framed_character.paste(frame, (0, 0), frame)
-            result.paste(framed_character, (placement[i][0] * 381, placement[i][1] * 570))
-
-        result.save(file_path)
+        try:
+            result = await self.renderer.render(character, [frame["url"] for frame in frames], digest=digest)
+        except RenderQueueFull:
+            await tag_message.reply("Too many frame tests are running, please try again in a bit.")
+            return
+        except TimeoutError:
+            await tag_message.reply("The frame test took too long, please try again.")
+            return
 
         embed = Embed(
             title="Frame Test",
             description="**Tested frame(s):** " + ", ".join(f"{title(frame['name'])} frame" for frame in frames),
             colour=Colour.light_grey())
         embed.set_image(url=f"attachment://{file_name}")
-        await tag_message.reply(embed=embed, file=File(file_path))
-
-        remove(file_path)
+        await tag_message.reply(embed=embed, file=File(BytesIO(result), filename=file_name))
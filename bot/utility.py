@@ -1,10 +1,12 @@
+from asyncio import FIRST_COMPLETED
+from asyncio import Queue
+from asyncio import create_task
+from asyncio import wait
+from io import BytesIO
 from logging import getLogger
-from re import MULTILINE
-from re import compile
-from re import findall
-from re import sub
 from typing import Callable
 
+from discord import File
 from discord import Interaction
 from discord import Message
 from discord import SelectOption
@@ -13,17 +15,24 @@ from discord.ext.commands import Bot
 from discord.ext.commands import Cog
 from discord.ui import Select
 from discord.ui import View
+from discord.ui import button
 
 from utils.checks import is_card_embed
+from utils.collection import CollectionCache
+from utils.collection import CollectionPages
+from utils.collection import render_clean_ad
+from utils.collection import render_codes
 from utils.db import read_json
 from utils.logger import get_log_decorator
+from utils.series import SeriesCleaner
 
 log_as = get_log_decorator(getLogger(__name__))
+MESSAGE_LIMIT = 2000
 
 
 class GetCleanAdSelect(Select):
 
-    def __init__(self, author_id, clean_series):
+    def __init__(self, author_id, series_cleaner, cards):
 
         super().__init__(
             placeholder="More cleaning options...",
@@ -47,7 +56,9 @@ class GetCleanAdSelect(Select):
                     emoji="💎")])
 
         self.author_id = author_id
-        self.clean_series = clean_series
+        self.series_cleaner = series_cleaner
+        # Parsed collection, every option combination is rendered from it
+        self.cards = cards
 
     async def callback(self, interaction: Interaction):
 
@@ -55,38 +66,89 @@ class GetCleanAdSelect(Select):
             await interaction.response.defer()
             return
 
-        new_msg = interaction.message.content
-
-        if "Remove infrequently used properties" in self.values:
-            # Remove wishlist
-            new_msg = sub(r" · \\``♡([\d ]{1,5})`\\`", "", new_msg)
-            # Remove effort
-            new_msg = sub(r" · \\``✧([\d ]{1,3})`\\`", "", new_msg)
-            # Remove effort
-            new_msg = sub(r" · ([★☆]{4})", "", new_msg)
-
-        if "Clean series names" in self.values:
-            for series in findall(compile(r".*· (.*)$", MULTILINE), new_msg):
-                if series in self.clean_series:
-                    new_msg = new_msg.replace(series, self.clean_series[series])
-
-        if "Add ticket emoji" in self.values:
-            new_msg = sub(compile(r"^(.*)", MULTILINE), r"🎟 \1", new_msg)
-
-        if "Add gem emoji" in self.values:
-            new_msg = sub(compile(r"^(.*)", MULTILINE), r"💎 \1", new_msg)
+        new_msg = render_clean_ad(
+            self.cards,
+            trim="Remove infrequently used properties" in self.values,
+            series_cleaner=self.series_cleaner if "Clean series names" in self.values else None,
+            ticket="Add ticket emoji" in self.values,
+            gem="Add gem emoji" in self.values)
 
         await interaction.message.edit(content=new_msg + "__\n__", view=None)
         await interaction.response.defer()
 
 
 class GetCleanAdView(View):
-    def __init__(self, author_id, clean_series):
+    def __init__(self, author_id, series_cleaner, cards):
         super().__init__(timeout=30)
-        self.add_item(GetCleanAdSelect(author_id, clean_series))
+        self.add_item(GetCleanAdSelect(author_id, series_cleaner, cards))
+
+
+# Results too long for a message are attached as a text file instead
+async def send_collection_result(interaction: Interaction, content: str, view: View = None):
 
+    if len(content) <= MESSAGE_LIMIT:
+        await interaction.response.edit_message(content=content, view=view)
+    else:
+        await interaction.response.edit_message(content=f"{interaction.user.mention}, result attached:", view=None)
+        await interaction.followup.send(file=File(BytesIO(content.encode()), filename="collection.txt"))
+
+
+class CollectPagesView(View):
+
+    def __init__(self, author_id, series_cleaner, pages: CollectionPages, edits: Queue):
+        super().__init__(timeout=300)
+        self.author_id = author_id
+        self.series_cleaner = series_cleaner
+        self.pages = pages
+        # Edits of the collection message not yet added to pages
+        self.edits = edits
+
+    # Adds every queued page, returns the number of new cards
+    def collect(self, payload=None):
+
+        payloads = [] if payload is None else [payload]
+        while not self.edits.empty():
+            payloads.append(self.edits.get_nowait())
+
+        added = 0
+        for payload in payloads:
+            embeds = payload.data.get("embeds", [])
+            if len(embeds) == 0 or embeds[0].get("title") != "Card Collection":
+                continue
+            added += self.pages.add(embeds[0].get("description", "")[40:])
+
+        return added
+
+    async def interaction_check(self, interaction_: Interaction):
+        if interaction_.user.id != self.author_id:
+            await interaction_.response.defer()
+            return False
+        return True
+
+    @button(label="Get Code", row=0)
+    async def button_code(self, interaction_: Interaction, _):
+        self.stop()
+        self.collect()
+        await send_collection_result(interaction_, render_codes(self.pages.all()))
+
+    @button(label="Get Clean Ad", row=0)
+    async def button_clean_ad(self, interaction_: Interaction, _):
+        self.stop()
+        self.collect()
+        cards = self.pages.all()
+
+        # Cleaning options edit the message, so only offer them if every option still fits
+        if len(render_clean_ad(cards, ticket=True, gem=True)) + 5 <= MESSAGE_LIMIT:
+            view = GetCleanAdView(self.author_id, self.series_cleaner, cards)
+        else:
+            view = None
+        await send_collection_result(interaction_, render_clean_ad(cards), view)
 
-async def get_main(interaction: Interaction, message: Message, collection_parser: Callable, view=None):
+
+# Renders the parsed collection, view is built from the cards too
+async def get_main(
+        interaction: Interaction, message: Message, collections: CollectionCache, render: Callable,
+        view: Callable = None):
 
     reply = interaction.response.send_message
     error_msg = "Message must be a card collection."
@@ -99,10 +161,11 @@ async def get_main(interaction: Interaction, message: Message, collection_parser
 
     # Send result
     else:
+        cards = collections.get(message.id, message.embeds[0].description[40:])
         if view is None:
-            await reply(collection_parser(message.embeds[0].description[40:]))
+            await reply(render(cards))
         else:
-            await reply(collection_parser(message.embeds[0].description[40:]), view=view)
+            await reply(render(cards), view=view(cards))
 
 
 async def setup(bot: Bot):
@@ -116,7 +179,8 @@ class Utility(Cog):
         self.bot = bot
         self.context_menus_raw = {
             "Get Code": self.get_code,
-            "Get Clean Ad": self.get_clean_ad}
+            "Get Clean Ad": self.get_clean_ad,
+            "Collect Pages": self.collect_pages}
         self.context_menus = []
 
         for name, func in self.context_menus_raw.items():
@@ -126,7 +190,9 @@ class Utility(Cog):
             self.bot.tree.add_command(context_menu)
             self.context_menus.append(context_menu)
 
-        self.clean_series = read_json("clean_series")
+        self.series_cleaner = SeriesCleaner(read_json("clean_series"))
+        # Shared by every context menu, users usually run several on the same collection
+        self.collections = CollectionCache()
 
     async def cog_unload(self) -> None:
         for context_menu in self.context_menus:
@@ -136,14 +202,48 @@ class Utility(Cog):
     async def get_clean_ad(self, interaction: Interaction, message: Message):
 
         await get_main(
-            interaction, message,
-            # First sub formats it, 2nd sub adds block code formatting
-            lambda collection: sub(r"`(.+?)`", r"\\``\1`\\`", sub(r"(.*?) (`♡[\d ]{1,5}`)?( · )?(`✧[\d ]{1,3}`)?( · )?\*\*(.+?)\*\* · `([★☆]{4})` · `(.+?)` · `◈(\d)` · (.+?) · \*\*(.+?)\*\*", r"\6 · \2\3\4\5\7 · `◈\9 \8` · \\*\\***\g<11>**\\*\\* · \g<10>", collection)),
-            view=GetCleanAdView(interaction.user.id, self.clean_series))
+            interaction, message, self.collections, render_clean_ad,
+            view=lambda cards: GetCleanAdView(interaction.user.id, self.series_cleaner, cards))
 
     @log_as("Get Code")
     async def get_code(self, interaction: Interaction, message: Message):
 
         await get_main(
-            interaction, message,
-            lambda collection: ", ".join(findall(r"\*\*`(.{3,6})`\*\*", collection)))
+            interaction, message, self.collections, render_codes)
+
+    @log_as("Collect Pages")
+    async def collect_pages(self, interaction: Interaction, message: Message):
+
+        if not is_card_embed("Card Collection", message) or \
+                message.embeds[0].description[-18:] == "The list is empty.":
+            await interaction.response.send_message("Message must be a card collection.", ephemeral=True)
+            return
+
+        pages = CollectionPages()
+        pages.add(message.embeds[0].description[40:])
+
+        def status():
+            return f"{interaction.user.mention}, collected {len(pages)} cards from {len(pages.pages)} page(s). " \
+                   f"Flip through the collection, then pick a result."
+
+        # Every page the user flips to is an edit of the collection message, queued for the whole session so
+        # pages flipped while the status is being updated aren't lost
+        with self.bot.router.subscribe_edits(message.id) as edits:
+            view = CollectPagesView(interaction.user.id, self.series_cleaner, pages, edits)
+            await interaction.response.send_message(status(), view=view)
+
+            finished = create_task(view.wait())
+            while not finished.done():
+                edit = create_task(edits.get())
+                await wait((finished, edit), return_when=FIRST_COMPLETED)
+
+                if not edit.done():
+                    edit.cancel()
+                    break
+
+                if view.collect(edit.result()) != 0 and not view.is_finished():
+                    await interaction.edit_original_message(content=status())
+
+        # Nothing picked before the view timed out
+        if finished.result():
+            await interaction.edit_original_message(content=status(), view=None)
@@ -10,11 +10,13 @@ from discord import Activity
 from discord import ActivityType
 from discord import Intents
 from discord import Message
+from discord import RawMessageUpdateEvent
 from discord import Status
 from discord.ext.commands import Bot
 
 from env import guild
 from env import token
+from utils.router import MessageRouter
 
 logging_basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
@@ -43,6 +45,7 @@ class CardUtils(Bot):
                 message_content=True),
             status=Status.online)
 
+        self.router = MessageRouter(self)
         self.ignore_files = ["_extchange", "_template"]
         # Disable error checking on testing environment
         if guild.id == 0:
@@ -75,8 +78,11 @@ class CardUtils(Bot):
                 logger.info("Commands resynced to Pixell's Lab scope")
 
     async def on_message(self, message: Message, /) -> None:
-        # Ignore all messages
-        pass
+        # Only hand messages to sessions waiting on them
+        self.router.dispatch(message)
+
+    async def on_raw_message_edit(self, payload: RawMessageUpdateEvent, /) -> None:
+        self.router.dispatch_edit(payload)
 
     # TODO replace with proper setup
     async def on_ready(self) -> None:
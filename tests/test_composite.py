@@ -0,0 +1,55 @@
+from numpy import array_equal
+from numpy import asarray
+from numpy import uint8
+from numpy import where
+from numpy.random import default_rng
+from PIL import Image
+from pytest import mark
+
+from utils.composite import CELL
+from utils.composite import CHARACTER
+from utils.composite import composite_frames
+from utils.composite import composite_frames_pillow
+from utils.composite import prepare_frame
+from utils.render import PLACEMENT
+from utils.render import SIZE
+
+rng = default_rng(0)
+
+
+# Random colours, with alpha a mix of transparent, opaque and partly transparent pixels
+def random_frame(size=CELL):
+
+    rgba = rng.integers(0, 256, (size[1], size[0], 4), dtype=uint8)
+    kind = rng.integers(0, 3, (size[1], size[0]))
+    rgba[:, :, 3] = where(kind == 0, 0, where(kind == 1, 255, rgba[:, :, 3]))
+    return Image.fromarray(rgba, "RGBA")
+
+
+def random_character(mode):
+
+    return Image.fromarray(rng.integers(0, 256, (CHARACTER[1], CHARACTER[0], len(mode)), dtype=uint8), mode)
+
+
+def assert_matches(character, frames):
+
+    size = SIZE[len(frames) - 1]
+    placement = PLACEMENT[:len(frames)]
+    expected = composite_frames_pillow(character, frames, size, placement)
+    result = composite_frames(character, [prepare_frame(frame) for frame in frames], size, placement)
+    assert array_equal(asarray(result), asarray(expected))
+
+
+@mark.parametrize("mode", ("RGB", "RGBA"))
+@mark.parametrize("count", (1, 3, 10))
+def test_random_frames(mode, count):
+
+    assert_matches(random_character(mode), [random_frame() for _ in range(count)])
+
+
+# Frames smaller than the cell are padded with transparency
+@mark.parametrize("mode", ("RGB", "RGBA"))
+@mark.parametrize("count", (1, 3, 10))
+def test_undersized_frames(mode, count):
+
+    assert_matches(random_character(mode), [random_frame((CELL[0] - 40, CELL[1] - 70)) for _ in range(count)])
@@ -0,0 +1,131 @@
+from asyncio import gather
+from asyncio import run
+from asyncio import sleep
+from contextlib import asynccontextmanager
+from hashlib import sha256
+from os import listdir
+
+from aiohttp import web
+from pytest import raises
+
+from utils.fetch import FetchError
+from utils.fetch import ImageFetcher
+
+IMAGES = {
+    "/small": b"small image" * 10,
+    "/other": b"other image" * 10,
+    "/third": b"third image" * 10,
+    "/large": b"x" * 4096}
+
+
+# Local stand-in for the image host, counts requests per path
+@asynccontextmanager
+async def image_server():
+
+    requests = {}
+
+    async def handler(request):
+        requests[request.path] = requests.get(request.path, 0) + 1
+        if request.path == "/slow":
+            await sleep(1)
+        # Slow enough that concurrent fetches overlap
+        await sleep(0.05)
+        return web.Response(body=IMAGES.get(request.path, b""))
+
+    app = web.Application()
+    app.router.add_get("/{name}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    try:
+        yield f"http://127.0.0.1:{port}", requests
+    finally:
+        await runner.cleanup()
+
+
+def test_cache_hit(tmp_path):
+
+    async def main():
+        async with image_server() as (base, requests):
+            fetcher = ImageFetcher(cache_dir=str(tmp_path))
+            digest, data = await fetcher.fetch(f"{base}/small")
+            assert (digest, data) == (sha256(IMAGES["/small"]).hexdigest(), IMAGES["/small"])
+            assert await fetcher.fetch(f"{base}/small") == (digest, data)
+            await fetcher.close()
+
+            # A new fetcher reads it back from disk
+            fetcher = ImageFetcher(cache_dir=str(tmp_path))
+            assert await fetcher.fetch(f"{base}/small") == (digest, data)
+            await fetcher.close()
+
+            assert requests == {"/small": 1}
+            assert fetcher.stats()["disk_hits"] == 1
+
+    run(main())
+
+
+def test_size_limit(tmp_path):
+
+    async def main():
+        async with image_server() as (base, _):
+            fetcher = ImageFetcher(cache_dir=str(tmp_path), max_size=1024)
+            with raises(FetchError):
+                await fetcher.fetch(f"{base}/large")
+            await fetcher.close()
+
+    run(main())
+
+
+def test_disk_budget(tmp_path):
+
+    async def main():
+        async with image_server() as (base, requests):
+            # Room for two images and their URL files
+            budget = 2 * (len(IMAGES["/small"]) + 64)
+            fetcher = ImageFetcher(cache_dir=str(tmp_path), max_cache_bytes=0, max_disk_bytes=budget)
+            for path in ("/small", "/other", "/third"):
+                await fetcher.fetch(f"{base}{path}")
+            assert fetcher.stats()["disk_bytes"] <= budget
+
+            # The oldest image was evicted and is downloaded again
+            await fetcher.fetch(f"{base}/small")
+            await fetcher.fetch(f"{base}/third")
+            assert requests == {"/small": 2, "/other": 1, "/third": 1}
+            await fetcher.close()
+
+            # The budget also holds for files left by an earlier run
+            fetcher = ImageFetcher(cache_dir=str(tmp_path), max_disk_bytes=budget // 2)
+            assert fetcher.stats()["disk_bytes"] <= budget // 2
+
+    run(main())
+
+
+def test_timeout(tmp_path):
+
+    async def main():
+        async with image_server() as (base, _):
+            fetcher = ImageFetcher(cache_dir=str(tmp_path), timeout=0.2)
+            with raises(FetchError):
+                await fetcher.fetch(f"{base}/slow")
+            await fetcher.close()
+
+    run(main())
+
+
+def test_concurrent_fetches(tmp_path):
+
+    async def main():
+        async with image_server() as (base, requests):
+            fetcher = ImageFetcher(cache_dir=str(tmp_path))
+            results = await gather(*(fetcher.fetch(f"{base}/small") for _ in range(5)))
+            await fetcher.close()
+
+            assert all(result == results[0] for result in results)
+            assert requests == {"/small": 1}
+            assert fetcher.stats()["misses"] == 1
+            assert not any(name.endswith(".tmp") for name in listdir(tmp_path) + listdir(tmp_path / "urls"))
+
+    run(main())
@@ -0,0 +1,165 @@
+from mmap import ACCESS_READ
+from mmap import mmap
+from os import fsync
+from os import replace
+from os import stat
+from os.path import exists
+from threading import Lock
+
+from numpy import bool_
+from numpy import frombuffer
+from numpy import uint8
+from numpy import uint16
+from numpy import uint32
+from orjson import loads
+from ujson import dumps
+
+from utils.composite import CELL
+from utils.composite import prepare_frame
+from utils.images import load_frame
+
+ATLAS_PATH = "data/frames/atlas.bin"
+INDEX_PATH = "data/frames/atlas.json"
+ATLAS_VERSION = 3
+
+# Every frame is stored as cell sized colour and one byte per pixel opaque mask, followed by the index,
+# premultiplied colour and inverse alpha of its partly transparent channels
+CELL_PIXELS = CELL[0] * CELL[1]
+PARTIAL_BYTES = 4 + 2 + 2
+
+
+def record_bytes(partial):
+
+    return 4 * CELL_PIXELS + partial * PARTIAL_BYTES
+
+
+# Atlas mapped by this worker process, as (generation, mmap)
+_mapped = None
+
+
+# Append-only file of preprocessed frames, shared with render workers through mmap
+class FrameAtlas:
+
+    def __init__(self, atlas_path=ATLAS_PATH, index_path=INDEX_PATH):
+
+        self.atlas_path = atlas_path
+        self.index_path = index_path
+        self.lock = Lock()
+
+        # URL -> (offset, PNG mtime, partly transparent channel count)
+        self.frames = {}
+        self.generation = 0
+        self.size = 0
+
+        if exists(self.index_path) and exists(self.atlas_path):
+            with open(self.index_path, "r") as index_file:
+                index = loads(index_file.read())
+            self.generation = index["generation"]
+            # Older layouts are rebuilt from scratch
+            if index.get("version") == ATLAS_VERSION:
+                self.frames = {url: tuple(entry) for url, entry in index["frames"].items()}
+                self.size = stat(self.atlas_path).st_size
+
+    def _write_index(self):
+
+        with open(f"{self.index_path}.tmp", "w") as index_file:
+            index_file.write(dumps({"version": ATLAS_VERSION, "generation": self.generation, "frames": self.frames}))
+        replace(f"{self.index_path}.tmp", self.index_path)
+
+    # Each record is written and synced as soon as it is prepared, so only one frame is held in memory
+    def _append(self, urls):
+
+        with open(self.atlas_path, "ab") as atlas_file:
+            for url in urls:
+                mtime = stat(f"data/frames/{url}.png").st_mtime_ns
+                arrays = prepare_frame(load_frame(url))
+                for array in arrays:
+                    atlas_file.write(array.data)
+                atlas_file.flush()
+                fsync(atlas_file.fileno())
+
+                self.frames[url] = (self.size, mtime, len(arrays[2]))
+                self.size += sum(array.nbytes for array in arrays)
+
+    # Rewrite the atlas without overwritten frames, under a new generation
+    def _compact(self):
+
+        frames = {}
+        size = 0
+        with open(self.atlas_path, "rb") as atlas_file, open(f"{self.atlas_path}.tmp", "wb") as new_file:
+            for url, (offset, mtime, partial) in self.frames.items():
+                atlas_file.seek(offset)
+                new_file.write(atlas_file.read(record_bytes(partial)))
+                frames[url] = (size, mtime, partial)
+                size += record_bytes(partial)
+            new_file.flush()
+            fsync(new_file.fileno())
+        replace(f"{self.atlas_path}.tmp", self.atlas_path)
+
+        self.frames = frames
+        self.size = size
+        self.generation += 1
+
+    # Add missing or changed frames, runs at startup
+    def build(self, urls):
+
+        with self.lock:
+            # Missing atlas or index, start over
+            if not exists(self.atlas_path) or len(self.frames) == 0:
+                open(self.atlas_path, "wb").close()
+                self.frames = {}
+                self.size = 0
+                self.generation += 1
+
+            stale = []
+            for url in dict.fromkeys(urls):
+                if not exists(f"data/frames/{url}.png"):
+                    continue
+                if url not in self.frames or self.frames[url][1] != stat(f"data/frames/{url}.png").st_mtime_ns:
+                    stale.append(url)
+
+            if len(stale) != 0:
+                self._append(stale)
+            if self.size > 2 * sum(record_bytes(entry[2]) for entry in self.frames.values()):
+                self._compact()
+            self._write_index()
+
+    # Frame was added or overwritten
+    def update(self, url):
+
+        with self.lock:
+            self._append([url])
+            self._write_index()
+
+    # Job description for render workers, record is None for frames not in the atlas
+    def lookup(self, urls):
+
+        return self.generation, tuple(
+            (url, (self.frames[url][0], self.frames[url][2]) if url in self.frames else None) for url in urls)
+
+    def stats(self):
+
+        return {
+            "frames": len(self.frames),
+            "bytes": self.size,
+            "generation": self.generation}
+
+
+# Frame arrays straight from the mapped atlas, runs inside a worker process
+def get_atlas_frame(generation, record, atlas_path=ATLAS_PATH):
+
+    global _mapped
+
+    offset, partial = record
+    if _mapped is None or _mapped[0] != generation or len(_mapped[1]) < offset + record_bytes(partial):
+        with open(atlas_path, "rb") as atlas_file:
+            _mapped = (generation, mmap(atlas_file.fileno(), 0, access=ACCESS_READ))
+
+    arrays = []
+    for dtype, count in ((uint8, 3 * CELL_PIXELS), (bool_, CELL_PIXELS), (uint32, partial), (uint16, partial),
+                         (uint16, partial)):
+        arrays.append(frombuffer(_mapped[1], dtype=dtype, count=count, offset=offset))
+        offset += arrays[-1].nbytes
+
+    return (arrays[0].reshape(CELL[1], CELL[0], 3), arrays[1].reshape(CELL[1], CELL[0]),
+            arrays[2], arrays[3], arrays[4])
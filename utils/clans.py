@@ -0,0 +1,131 @@
+from asyncio import create_task
+
+# Tables behind clanverify_roles
+CLAN_TABLES = ("clanverify", "clanroles")
+
+
+# Read-through cache of clanverify_roles rows by guild and by shogun
+# Every committed write to the clan tables is reported by the database, so rows are never stale
+class ClanCache:
+
+    def __init__(self, db):
+
+        self.db = db
+        db.on_change(self._invalidate)
+        # Guild id -> {shogun id -> row}, only for guilds loaded in full
+        self.guilds = {}
+        # Shogun id -> row
+        self.shoguns = {}
+        # Shogun id -> reloads in flight, the guild a changed clan is now in is unknown until it is read back
+        self.pending = {}
+        self.reloads = set()
+        # Bumped on every change, reads that raced a change don't fill the cache
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+
+        return len(self.shoguns)
+
+    # One bulk query at startup, every guild with a clan is then loaded in full
+    async def warm(self):
+
+        self.clear()
+
+        for row in await self.db.execute("SELECT * FROM clanverify_roles", fetch="all"):
+            self.guilds.setdefault(row[1], {})[row[0]] = row
+            self.shoguns[row[0]] = row
+
+    # Clans in the guild, sorted by shogun id
+    async def get_guild(self, guild_id):
+
+        # A pending clan may have moved into any guild, so guild lists aren't served from the cache until then
+        if guild_id in self.guilds and len(self.pending) == 0:
+            self.hits += 1
+            return sorted(self.guilds[guild_id].values())
+
+        self.misses += 1
+        version = self.version
+        rows = await self.db.execute("SELECT * FROM clanverify_roles WHERE guild_id = ?", (guild_id,), fetch="all")
+
+        if version == self.version:
+            self.guilds[guild_id] = {row[0]: row for row in rows}
+            for row in rows:
+                self.shoguns[row[0]] = row
+
+        return sorted(rows)
+
+    async def get_shogun(self, shogun_id):
+
+        if shogun_id in self.shoguns:
+            self.hits += 1
+            return self.shoguns[shogun_id]
+
+        self.misses += 1
+        return await self._load_shogun(shogun_id)
+
+    async def _load_shogun(self, shogun_id):
+
+        version = self.version
+        row = await self.db.execute("SELECT * FROM clanverify_roles WHERE id = ?", (shogun_id,), fetch="one")
+
+        if row is not None and version == self.version:
+            self.shoguns[shogun_id] = row
+            if row[1] in self.guilds:
+                self.guilds[row[1]][shogun_id] = row
+
+        return row
+
+    def remove(self, shogun_id):
+
+        self.version += 1
+        row = self.shoguns.pop(shogun_id, None)
+        if row is not None and row[1] in self.guilds:
+            self.guilds[row[1]].pop(shogun_id, None)
+
+    def clear(self):
+
+        self.version += 1
+        self.guilds.clear()
+        self.shoguns.clear()
+
+    # Runs as the write commits, so no reader can get the old row after it
+    def _invalidate(self, table, shogun_id):
+
+        if table is not None and table not in CLAN_TABLES:
+            return
+
+        # Unknown write, nothing cached can be trusted
+        if table is None or shogun_id is None:
+            self.clear()
+            return
+
+        self.remove(shogun_id)
+        self.pending[shogun_id] = self.pending.get(shogun_id, 0) + 1
+        reload = create_task(self._reload(shogun_id))
+        self.reloads.add(reload)
+        reload.add_done_callback(self.reloads.discard)
+
+    # The changed clan is read back so a fully loaded guild it moved into stays complete
+    async def _reload(self, shogun_id):
+
+        try:
+            await self._load_shogun(shogun_id)
+        # Dropped from the cache already, it is read through on next use
+        except Exception:
+            pass
+        finally:
+            self.pending[shogun_id] -= 1
+            if self.pending[shogun_id] == 0:
+                del self.pending[shogun_id]
+
+    def stats(self):
+
+        total = self.hits + self.misses
+        return {
+            "clans": len(self.shoguns),
+            "guilds": len(self.guilds),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0}
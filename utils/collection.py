@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from re import compile
+
+COLLECTION_CACHE_SIZE = 256
+
+# Karuta collection line: tag, optional wishlist and effort, code, quality, print number, edition, series, character
+line_pattern = compile(
+    r"(.*?) (?:`♡([\d ]{1,5})`)?(?: · )?(?:`✧([\d ]{1,3})`)?(?: · )?\*\*`(.+?)`\*\* · `([★☆]{4})` · `(.+?)` · "
+    r"`◈(\d)` · (.+?) · \*\*(.+?)\*\*")
+code_pattern = compile(r"`(.+?)`")
+
+
+class Card:
+
+    __slots__ = ("tag", "wishlist", "effort", "code", "quality", "number", "edition", "series", "character", "rest")
+
+    def __init__(self, tag, wishlist, effort, code, quality, number, edition, series, character, rest=""):
+
+        self.tag = tag
+        # None when the collection doesn't show them
+        self.wishlist = wishlist
+        self.effort = effort
+        self.code = code
+        self.quality = quality
+        self.number = number
+        self.edition = edition
+        self.series = series
+        self.character = character
+        # Anything after the character name
+        self.rest = rest
+
+
+# Card collection embed description -> cards, lines that aren't cards are kept as is
+def parse_collection(description: str):
+
+    cards = []
+    for line in description.split("\n"):
+        match = line_pattern.match(line)
+        cards.append(line if match is None else Card(*match.groups(), line[match.end():]))
+
+    return cards
+
+
+# LRU cache of parsed collections, keyed by message id and description hash so edited messages are parsed again
+class CollectionCache:
+
+    def __init__(self, max_entries=COLLECTION_CACHE_SIZE):
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # (message id, description hash) -> cards
+        self.collections = OrderedDict()
+
+    def __len__(self):
+
+        return len(self.collections)
+
+    def get(self, message_id, description):
+
+        key = (message_id, hash(description))
+        if key in self.collections:
+            self.hits += 1
+            self.collections.move_to_end(key)
+            return self.collections[key]
+
+        self.misses += 1
+        cards = parse_collection(description)
+        self.collections[key] = cards
+        if len(self.collections) > self.max_entries:
+            self.collections.popitem(last=False)
+
+        return cards
+
+    def stats(self):
+
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.collections),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0}
+
+
+# Unique cards from every page of a collection seen so far, in the order they were first seen
+class CollectionPages:
+
+    def __init__(self):
+
+        # Code -> card
+        self.cards = {}
+        # Hashes of page descriptions already parsed, paging back and forth is common
+        self.pages = set()
+
+    def __len__(self):
+
+        return len(self.cards)
+
+    # Number of new cards on the page
+    def add(self, description):
+
+        page = hash(description)
+        if page in self.pages:
+            return 0
+        self.pages.add(page)
+
+        count = len(self.cards)
+        for card in parse_collection(description):
+            if isinstance(card, Card):
+                self.cards.setdefault(card.code, card)
+
+        return len(self.cards) - count
+
+    def all(self):
+
+        return list(self.cards.values())
+
+
+# Inline code shown with its backticks
+def _escape_code(text):
+
+    return code_pattern.sub(r"\\``\1`\\`", text)
+
+
+def render_codes(cards):
+
+    return ", ".join(card.code for card in cards if isinstance(card, Card) and 3 <= len(card.code) <= 6)
+
+
+def render_clean_ad(cards, trim=False, series_cleaner=None, ticket=False, gem=False):
+
+    prefix = ("💎 " if gem else "") + ("🎟 " if ticket else "")
+
+    lines = []
+    for card in cards:
+
+        if isinstance(card, str):
+            lines.append(prefix + _escape_code(card))
+            continue
+
+        properties = [f"\\``{card.code}`\\`"]
+        # Wishlist, effort and quality are rarely needed in an ad
+        if not trim:
+            if card.wishlist is not None:
+                properties.append(f"\\``♡{card.wishlist}`\\`")
+            if card.effort is not None:
+                properties.append(f"\\``✧{card.effort}`\\`")
+            properties.append(card.quality)
+
+        series = card.series if series_cleaner is None else series_cleaner.clean(card.series)
+        properties += [f"\\``◈{card.edition} {card.number}`\\`", f"\\*\\***{card.character}**\\*\\*", series]
+        lines.append(prefix + " · ".join(properties) + _escape_code(card.rest))
+
+    return "\n".join(lines)
@@ -0,0 +1,117 @@
+from numpy import arange
+from numpy import asarray
+from numpy import copyto
+from numpy import empty
+from numpy import flatnonzero
+from numpy import repeat
+from numpy import uint8
+from numpy import uint16
+from numpy import uint32
+from numpy import zeros
+from PIL import Image
+
+from utils.images import FRAME_CACHE_BYTES
+from utils.images import FrameImageCache
+from utils.images import load_frame
+
+CELL = (381, 570)
+CHARACTER = (319, 441)
+CHARACTER_OFFSET = (31, 76)
+BACKGROUND = (46, 49, 54)
+PIXEL = "V3"
+
+
+# Frame split by alpha, padded with transparency to the cell size:
+# colour, one channel opaque mask, and flat indices, colour * alpha and 255 - alpha of the partly transparent pixels
+def prepare_frame(image):
+
+    rgba = zeros((CELL[1], CELL[0], 4), dtype=uint8)
+    frame = asarray(image.convert("RGBA"))[:CELL[1], :CELL[0]]
+    rgba[:frame.shape[0], :frame.shape[1]] = frame
+
+    colour = rgba[:, :, :3].copy()
+    alpha = rgba[:, :, 3]
+    opaque = alpha == 255
+
+    pixels = flatnonzero((alpha != 0) & (alpha != 255))
+    index = (pixels[:, None] * 3 + arange(3)).reshape(-1).astype(uint32)
+    partial_alpha = repeat(alpha.reshape(-1)[pixels].astype(uint16), 3)
+    premultiplied = colour.reshape(-1)[index].astype(uint16) * partial_alpha
+
+    return colour, opaque, index, premultiplied, 255 - partial_alpha
+
+
+def load_frame_arrays(url):
+
+    return prepare_frame(load_frame(url))
+
+
+def arrays_bytes(arrays):
+
+    return sum(array.nbytes for array in arrays)
+
+
+# Character pasted onto a black cell, shared by every frame
+def _base_cell(character):
+
+    cell = zeros((CELL[1], CELL[0], 3), dtype=uint8)
+    x, y = CHARACTER_OFFSET
+    cell[y:y + CHARACTER[1], x:x + CHARACTER[0]] = asarray(character.convert("RGB"))
+
+    return cell
+
+
+# Same result as composite_frames_pillow, but only partly transparent pixels are blended,
+# with the same rounding as Pillow's masked paste
+def composite_frames(character, frames, size, placement):
+
+    base = _base_cell(character)
+    flat_base = base.reshape(-1)
+    cell = empty(base.shape, dtype=uint8)
+    flat_cell = cell.reshape(-1)
+    # Whole pixels as single 3 byte values, so the one channel mask applies without broadcasting
+    cell_pixels = cell.view(PIXEL)[:, :, 0]
+
+    canvas = empty((size[1] * CELL[1], size[0] * CELL[0], 3), dtype=uint8)
+    for x in range(size[0]):
+        for y in range(size[1]):
+            if (x, y) not in placement:
+                # Per channel fills are much faster than broadcasting the colour
+                for channel in range(3):
+                    canvas[y * CELL[1]:(y + 1) * CELL[1], x * CELL[0]:(x + 1) * CELL[0], channel] = \
+                        BACKGROUND[channel]
+
+    for (colour, opaque, index, premultiplied, inverse_alpha), (x, y) in zip(frames, placement):
+
+        # Transparent pixels keep the character, opaque pixels take the frame
+        copyto(cell, base)
+        copyto(cell_pixels, colour.view(PIXEL)[:, :, 0], where=opaque)
+
+        blended = flat_base.take(index).astype(uint16)
+        blended *= inverse_alpha
+        blended += premultiplied
+        blended += 128
+        blended += blended >> 8
+        blended >>= 8
+        flat_cell[index] = blended
+
+        copyto(canvas[y * CELL[1]:(y + 1) * CELL[1], x * CELL[0]:(x + 1) * CELL[0]], cell)
+
+    return Image.fromarray(canvas, "RGB")
+
+
+# Reference Pillow compositing, composite_frames must match it exactly
+def composite_frames_pillow(character, frames, size, placement):
+
+    result = Image.new("RGB", (size[0] * CELL[0], size[1] * CELL[1]), BACKGROUND)
+
+    for i, frame in enumerate(frames):
+        framed_character = Image.new("RGB", CELL)
+        framed_character.paste(character, CHARACTER_OFFSET)
+        framed_character.paste(frame, (0, 0), frame)
+        result.paste(framed_character, (placement[i][0] * CELL[0], placement[i][1] * CELL[1]))
+
+    return result
+
+
+frame_arrays = FrameImageCache(max_bytes=FRAME_CACHE_BYTES, loader=load_frame_arrays, sizeof=arrays_bytes)
@@ -1,8 +1,37 @@
+from asyncio import Queue
+from asyncio import TimeoutError
+from asyncio import create_task
+from asyncio import get_running_loop
+from asyncio import sleep
+from asyncio import wait_for
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from re import IGNORECASE
+from re import compile
+
 from aiofiles import open as aopen
 from orjson import loads
 from ujson import dumps
+from aiosqlite import OperationalError
 from aiosqlite import connect
 
+from utils.migrations import MIGRATIONS
+
+# Prepared statements kept per connection, statements are matched by their exact text
+STATEMENT_CACHE_SIZE = 256
+# Read-only connections, each one runs on its own thread
+READER_COUNT = 4
+# Writes are committed together once this many are queued, or this long after the first one
+WRITE_BATCH_SIZE = 64
+WRITE_DEADLINE = 0.005
+# Writers wait for room once this many writes are queued
+MAX_QUEUED_WRITES = 1024
+# Busy BEGIN IMMEDIATE is retried with exponential backoff
+BEGIN_RETRIES = 5
+BEGIN_BACKOFF = 0.01
+
+write_pattern = compile(r"(?:INSERT(?: OR \w+)? INTO|REPLACE INTO|UPDATE(?: OR \w+)?|DELETE FROM) (\w+)", IGNORECASE)
+
 
 # Internal sort
 def _sort(item):
@@ -64,51 +93,344 @@ async def awrite_value_json(file, **kwargs):
     await awrite_json(file, data)
 
 
-# Async SQLite3
-class SQLite3:
-
-    def __init__(self):
+# Collapse whitespace once per distinct statement, callers pass constant SQL with bound parameters
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _normalize(command):
+    return " ".join(command.split())
 
-        self.made_changes = False
-        self.db = None
 
-    async def connect(self, file):
+# Table a write changes, None if it can't be told from the statement
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _written_table(command):
+    match = write_pattern.match(_normalize(command))
+    return None if match is None else match.group(1)
 
-        self.db = await connect(f"data/sqlite3s/{file}.sqlite3")
 
-    async def execute(self, command, fetch=None, made_changes=False):
+# Statements a read-only connection can run, pragmas only when queried rather than set
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _is_read(command):
+    command = _normalize(command).upper()
+    return command.startswith(("SELECT", "EXPLAIN")) or command.startswith("PRAGMA") and "=" not in command
 
-        async with self.db.execute(" ".join(command.split())) as cursor:
-            self.made_changes = made_changes
-            if fetch is None:
-                return_value = 0
-            elif fetch == "all":
-                return_value = await cursor.fetchall()
-            elif fetch == "one":
-                return_value = await cursor.fetchone()
 
-        return return_value
+async def _fetch(connection, command, parameters, fetch):
 
-    async def commit(self):
+    async with connection.execute(_normalize(command), parameters) as cursor:
+        if fetch is None:
+            return_value = 0
+        elif fetch == "all":
+            return_value = await cursor.fetchall()
+        elif fetch == "one":
+            return_value = await cursor.fetchone()
 
-        if self.made_changes:
-            await self.db.commit()
-            self.made_changes = False
+    return return_value
 
-    async def close(self):
 
-        await self.db.close()
+# Key helpers for anything with execute
+class _Keys:
 
+    # Table and column names come from code, only values are user data and those are always bound
     async def del_key(self, table, primary_key):
 
-        await self.execute(f"DELETE FROM {table} WHERE id = {primary_key}", made_changes=True)
+        await self.execute(
+            f"DELETE FROM {table} WHERE id = ?", (primary_key,), made_changes=True, changed=(table, primary_key))
 
     async def get_key(self, table, primary_key):
 
-        return await self.execute(f"SELECT * FROM {table} WHERE id = {primary_key}", fetch="one")
+        return await self.execute(f"SELECT * FROM {table} WHERE id = ?", (primary_key,), fetch="one")
 
     async def set_key(self, table, primary_key, **kwargs):
 
         keys = f"id, {', '.join(kwargs.keys())}"
-        values = f"{primary_key}, " + ', '.join(str(x) for x in kwargs.values())
-        await self.execute(f"INSERT OR REPLACE INTO {table} ({keys}) VALUES ({values})", made_changes=True)
+        values = ", ".join("?" * (len(kwargs) + 1))
+        await self.execute(
+            f"INSERT OR REPLACE INTO {table} ({keys}) VALUES ({values})", (primary_key, *kwargs.values()),
+            made_changes=True, changed=(table, primary_key))
+
+
+# Reads and writes inside SQLite3.transaction, all on the writer connection
+class Transaction(_Keys):
+
+    def __init__(self, db):
+
+        self.db = db
+        # (table, primary key) of every write, reported once the transaction commits
+        self.changes = {}
+
+    async def execute(self, command, parameters=(), fetch=None, made_changes=False, changed=None):
+
+        return_value = await _fetch(self.db, command, parameters, fetch)
+        if made_changes or not _is_read(command):
+            self.changes[changed or (_written_table(command), None)] = None
+
+        return return_value
+
+
+# Async SQLite3 in WAL mode, reads share a pool of read-only connections and writes are group committed by
+# a write-behind queue on a single writer connection
+class SQLite3(_Keys):
+
+    def __init__(
+            self, readers=READER_COUNT, write_batch_size=WRITE_BATCH_SIZE, write_deadline=WRITE_DEADLINE,
+            max_queued_writes=MAX_QUEUED_WRITES):
+
+        # Writer connection
+        self.db = None
+        self.reader_count = readers
+        self.readers = []
+        self.idle_readers = Queue()
+        self.write_batch_size = write_batch_size
+        self.write_deadline = write_deadline
+        # (command, parameters, changed, future), (None, grant, done) for transactions, None stops the writer
+        self.writes = Queue(max_queued_writes)
+        self.writer = None
+        # Called with (table, primary key) of each write as soon as it commits, before its writer resumes,
+        # either is None when unknown
+        self.invalidators = []
+
+        self.reads = 0
+        self.waiting_reads = 0
+        self.peak_waiting_reads = 0
+        self.batches = 0
+        self.committed_writes = 0
+        self.transactions = 0
+
+    async def connect(self, file):
+
+        path = f"data/sqlite3s/{file}.sqlite3"
+
+        # Transactions are managed explicitly, never implicitly opened by sqlite3
+        self.db = await connect(path, cached_statements=STATEMENT_CACHE_SIZE, isolation_level=None)
+        # Every commit is synced to the WAL, batching keeps that to one sync per batch
+        await self.db.execute("PRAGMA journal_mode = WAL")
+        await self.db.execute("PRAGMA synchronous = FULL")
+        await self.migrate(MIGRATIONS.get(file, []))
+        self.writer = create_task(self._write_behind())
+
+        # Opened after migrating so every reader sees the current schema
+        for _ in range(self.reader_count):
+            reader = await connect(
+                f"file:{path}?mode=ro", uri=True, cached_statements=STATEMENT_CACHE_SIZE, isolation_level=None)
+            self.readers.append(reader)
+            self.idle_readers.put_nowait(reader)
+
+    # Apply migrations newer than the recorded schema version, each one in its own transaction
+    async def migrate(self, migrations):
+
+        await self.db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP)""")
+        async with self.db.execute("SELECT MAX(version) FROM schema_version") as cursor:
+            version = (await cursor.fetchone())[0] or 0
+
+        for version, statements in enumerate(migrations[version:], version + 1):
+            await self.db.execute("BEGIN")
+            try:
+                for statement in statements:
+                    await self.db.execute(statement)
+                await self.db.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+            except Exception:
+                await self.db.execute("ROLLBACK")
+                raise
+            await self.db.execute("COMMIT")
+
+    # Sleeps on the queue while idle, then commits everything queued within the deadline in one transaction
+    async def _write_behind(self):
+
+        loop = get_running_loop()
+        stopping = False
+
+        while not stopping:
+            write = await self.writes.get()
+            if write is None:
+                break
+            if write[0] is None:
+                await self._hand_over(*write[1:])
+                continue
+
+            batch = [write]
+            transaction = None
+            deadline = loop.time() + self.write_deadline
+            while len(batch) < self.write_batch_size:
+                try:
+                    write = await wait_for(self.writes.get(), deadline - loop.time())
+                except TimeoutError:
+                    break
+                if write is None:
+                    stopping = True
+                    break
+                # Writes queued before a transaction commit before it
+                if write[0] is None:
+                    transaction = write
+                    break
+                batch.append(write)
+
+            await self._commit(batch)
+            if transaction is not None:
+                await self._hand_over(*transaction[1:])
+
+    # Lend the writer connection to a transaction until it is done
+    @staticmethod
+    async def _hand_over(grant, done):
+
+        # Gave up while waiting
+        if grant.done():
+            return
+
+        grant.set_result(None)
+        await done
+
+    async def _begin(self):
+
+        for attempt in range(BEGIN_RETRIES):
+            try:
+                await self.db.execute("BEGIN IMMEDIATE")
+                return
+            except OperationalError as err:
+                if "locked" not in str(err) and "busy" not in str(err) or attempt == BEGIN_RETRIES - 1:
+                    raise
+            await sleep(BEGIN_BACKOFF * 2 ** attempt)
+
+    async def _commit(self, batch):
+
+        try:
+            await self._begin()
+        except Exception as err:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+
+        # A failed statement only fails its own writer, the rest of the batch still commits
+        for command, parameters, _, future in batch:
+            try:
+                await self.db.execute(_normalize(command), parameters)
+            except Exception as err:
+                if not future.done():
+                    future.set_exception(err)
+
+        try:
+            await self.db.execute("COMMIT")
+        except Exception as err:
+            if self.db.in_transaction:
+                await self.db.execute("ROLLBACK")
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+        else:
+            self.batches += 1
+            for _, _, changed, future in batch:
+                if not future.done():
+                    self.committed_writes += 1
+                    self._invalidate(*changed)
+                    future.set_result(None)
+
+    # Statements run in one BEGIN IMMEDIATE transaction, committed with a single sync, rolled back on errors
+    @asynccontextmanager
+    async def transaction(self):
+
+        loop = get_running_loop()
+        grant = loop.create_future()
+        done = loop.create_future()
+        await self.writes.put((None, grant, done))
+
+        try:
+            await grant
+        except BaseException:
+            # Cancelled just as the connection was handed over, give it back
+            if grant.done() and not grant.cancelled():
+                done.set_result(None)
+            raise
+
+        try:
+            await self._begin()
+            transaction = Transaction(self.db)
+            try:
+                yield transaction
+            except BaseException:
+                if self.db.in_transaction:
+                    await self.db.execute("ROLLBACK")
+                raise
+            try:
+                await self.db.execute("COMMIT")
+            except Exception:
+                if self.db.in_transaction:
+                    await self.db.execute("ROLLBACK")
+                raise
+            self.transactions += 1
+            for table, primary_key in transaction.changes:
+                self._invalidate(table, primary_key)
+        finally:
+            done.set_result(None)
+
+    # Caches register here instead of relying on every writer to update them
+    def on_change(self, invalidate):
+
+        self.invalidators.append(invalidate)
+
+    def _invalidate(self, table, primary_key):
+
+        for invalidate in self.invalidators:
+            invalidate(table, primary_key)
+
+    # Resolves once the write is committed and synced
+    async def write(self, command, parameters=(), changed=None):
+
+        future = get_running_loop().create_future()
+        await self.writes.put((command, parameters, changed or (_written_table(command), None), future))
+        await future
+
+    # Runs on whichever reader is free, reads on different readers run in parallel
+    async def read(self, command, parameters=(), fetch=None):
+
+        if self.idle_readers.empty():
+            self.waiting_reads += 1
+            self.peak_waiting_reads = max(self.peak_waiting_reads, self.waiting_reads)
+            try:
+                reader = await self.idle_readers.get()
+            finally:
+                self.waiting_reads -= 1
+        else:
+            reader = self.idle_readers.get_nowait()
+
+        try:
+            return_value = await _fetch(reader, command, parameters, fetch)
+        finally:
+            self.idle_readers.put_nowait(reader)
+        self.reads += 1
+
+        return return_value
+
+    async def execute(self, command, parameters=(), fetch=None, made_changes=False, changed=None):
+
+        # Same rule as Transaction.execute, anything a reader can't run goes to the writer
+        if made_changes or not _is_read(command):
+            await self.write(command, parameters, changed)
+            return 0
+
+        return await self.read(command, parameters, fetch)
+
+    def stats(self):
+
+        return {
+            "readers": self.reader_count,
+            "idle_readers": self.idle_readers.qsize(),
+            "waiting_reads": self.waiting_reads,
+            "peak_waiting_reads": self.peak_waiting_reads,
+            "reads": self.reads,
+            "queued_writes": self.writes.qsize(),
+            "max_queued_writes": self.writes.maxsize,
+            "batches": self.batches,
+            "writes": self.committed_writes,
+            "transactions": self.transactions}
+
+    # Queued writes are still committed
+    async def close(self):
+
+        if self.writer is not None:
+            await self.writes.put(None)
+            await self.writer
+        for reader in self.readers:
+            await reader.close()
+        await self.db.close()
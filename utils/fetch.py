@@ -0,0 +1,263 @@
+from asyncio import TimeoutError
+from asyncio import create_task
+from asyncio import shield
+from collections import OrderedDict
+from hashlib import sha256
+from os import makedirs
+from os import replace
+from os import scandir
+from os import unlink
+from os import utime
+from os.path import dirname
+from tempfile import mkstemp
+
+from aiofiles import open as aopen
+from aiohttp import ClientError
+from aiohttp import ClientSession
+from aiohttp import ClientTimeout
+from aiohttp import TCPConnector
+
+CACHE_DIR = "data/cache/images"
+
+
+class FetchError(Exception):
+    pass
+
+
+# Async image downloader with a memory and content-addressed disk cache
+class ImageFetcher:
+
+    def __init__(self, cache_dir=CACHE_DIR, max_size=8 * 1024 * 1024, max_cache_bytes=32 * 1024 * 1024,
+                 max_disk_bytes=256 * 1024 * 1024, connections=16, timeout=10.0):
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_cache_bytes = max_cache_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.connections = connections
+        self.timeout = timeout
+        self.session = None
+
+        # URL -> (digest, data)
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        # URL -> task loading it from disk or the network, concurrent fetches of a URL share it
+        self.loading = {}
+        # Path of every blob and URL file -> size, least recently used first
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared = 0
+        self.misses = 0
+
+        makedirs(f"{self.cache_dir}/urls", exist_ok=True)
+        self._scan_disk()
+
+    def _url_path(self, url):
+
+        return f"{self.cache_dir}/urls/{sha256(url.encode()).hexdigest()}"
+
+    def _blob_path(self, digest):
+
+        return f"{self.cache_dir}/{digest}"
+
+    def _remember(self, url, digest, data):
+
+        if len(data) > self.max_cache_bytes:
+            return
+
+        self.cache[url] = (digest, data)
+        self.cache_bytes += len(data)
+        while self.cache_bytes > self.max_cache_bytes:
+            _, (_, old_data) = self.cache.popitem(last=False)
+            self.cache_bytes -= len(old_data)
+
+    # Index the files left by earlier runs, oldest first, and drop temp files from interrupted writes
+    def _scan_disk(self):
+
+        files = []
+        for directory in (self.cache_dir, f"{self.cache_dir}/urls"):
+            with scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.is_file():
+                        continue
+                    if entry.name.endswith(".tmp"):
+                        unlink(entry.path)
+                        continue
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.path, stat.st_size))
+
+        for _, path, size in sorted(files):
+            self._add_disk(path, size)
+        self._evict_disk()
+
+    def _add_disk(self, path, size):
+
+        self.disk_bytes += size - self.disk.pop(path, 0)
+        self.disk[path] = size
+
+    # Mtime orders the files on the next start
+    def _touch_disk(self, path):
+
+        if path not in self.disk:
+            return
+        self.disk.move_to_end(path)
+        try:
+            utime(path)
+        except OSError:
+            pass
+
+    def _remove_disk(self, path):
+
+        self.disk_bytes -= self.disk.pop(path, 0)
+        try:
+            unlink(path)
+        except FileNotFoundError:
+            pass
+
+    # URL files whose blob was evicted are dropped when next read
+    def _evict_disk(self):
+
+        while self.disk_bytes > self.max_disk_bytes:
+            self._remove_disk(next(iter(self.disk)))
+
+    async def _read_disk(self, url):
+
+        url_path = self._url_path(url)
+        if url_path not in self.disk:
+            return None
+
+        try:
+            async with aopen(url_path, "r") as url_file:
+                digest = await url_file.read()
+            blob_path = self._blob_path(digest)
+            if blob_path not in self.disk:
+                self._remove_disk(url_path)
+                return None
+
+            async with aopen(blob_path, "rb") as blob_file:
+                data = await blob_file.read()
+
+        # Evicted while being read
+        except FileNotFoundError:
+            return None
+
+        self._touch_disk(url_path)
+        self._touch_disk(blob_path)
+
+        return digest, data
+
+    # Unique temp file in the same directory, so writers never share one and the rename is atomic
+    @staticmethod
+    async def _write_file(path, data):
+
+        file, temp_path = mkstemp(dir=dirname(path), suffix=".tmp")
+        try:
+            async with aopen(file, "wb") as temp_file:
+                await temp_file.write(data)
+            replace(temp_path, path)
+        except BaseException:
+            unlink(temp_path)
+            raise
+
+    async def _write_disk(self, url, digest, data):
+
+        if len(data) > self.max_disk_bytes:
+            return
+
+        # Identical images under different URLs share a blob
+        blob_path = self._blob_path(digest)
+        if blob_path in self.disk:
+            self._touch_disk(blob_path)
+        else:
+            await self._write_file(blob_path, data)
+            self._add_disk(blob_path, len(data))
+
+        url_path = self._url_path(url)
+        await self._write_file(url_path, digest.encode())
+        self._add_disk(url_path, len(digest))
+
+        self._evict_disk()
+
+    async def _download(self, url):
+
+        if self.session is None or self.session.closed:
+            self.session = ClientSession(
+                connector=TCPConnector(limit=self.connections),
+                timeout=ClientTimeout(total=self.timeout))
+
+        try:
+            async with self.session.get(url) as response:
+                if response.status != 200:
+                    raise FetchError(f"{url} returned status {response.status}")
+                if (response.content_length or 0) > self.max_size:
+                    raise FetchError(f"{url} is larger than {self.max_size} bytes")
+
+                data = bytearray()
+                async for chunk in response.content.iter_chunked(65536):
+                    data += chunk
+                    if len(data) > self.max_size:
+                        raise FetchError(f"{url} is larger than {self.max_size} bytes")
+
+        except (ClientError, TimeoutError) as err:
+            raise FetchError(f"{url} could not be downloaded") from err
+
+        return bytes(data)
+
+    async def _load(self, url):
+
+        try:
+            cached = await self._read_disk(url)
+            if cached is not None:
+                self.disk_hits += 1
+                self._remember(url, *cached)
+                return cached
+
+            self.misses += 1
+            data = await self._download(url)
+            digest = sha256(data).hexdigest()
+            # The disk cache is best effort, a failed write still returns the image
+            try:
+                await self._write_disk(url, digest, data)
+            except OSError:
+                pass
+            self._remember(url, digest, data)
+
+            return digest, data
+
+        finally:
+            del self.loading[url]
+
+    # Returns (sha256 digest, data) of the image at the URL
+    async def fetch(self, url):
+
+        if url in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(url)
+            return self.cache[url]
+
+        if url in self.loading:
+            self.shared += 1
+        else:
+            self.loading[url] = create_task(self._load(url))
+
+        # A cancelled fetch doesn't cancel the load for the others waiting on it
+        return await shield(self.loading[url])
+
+    def stats(self):
+
+        return {
+            "entries": len(self.cache),
+            "bytes": self.cache_bytes,
+            "disk_files": len(self.disk),
+            "disk_bytes": self.disk_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "shared": self.shared,
+            "misses": self.misses}
+
+    async def close(self):
+
+        if self.session is not None:
+            await self.session.close()
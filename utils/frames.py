@@ -0,0 +1,219 @@
+from bisect import insort
+from os import remove
+from os import replace
+from os.path import exists
+from string import capwords as title
+
+from aiofiles import open as aopen
+from orjson import loads
+from ujson import dumps
+
+from utils.fuzzy import FuzzyIndex
+
+IMAGE_URL = "https://d2l56h9h5tj8ue.cloudfront.net/images/frames/frame-{}.jpg"
+
+
+# Frame shop information block
+def _info_block(tags):
+
+    try:
+        if "bit" in tags:
+            basic_index = tags.index("basic")
+            info = ["# Type:", "- Basic / Bit",
+                    "# Cost:", f"- 2500 {tags[basic_index + 1]} bits\n- 2500 {tags[basic_index + 2]} bits"]
+        elif "gem" in tags:
+            info = ["# Type:", "- Carousel / Gem", "# Cost:", "- 1000 gems (in rotation)"]
+        elif "special" in tags:
+            info = ["# Type:", "- Special", "# Cost:", "- Special Frames Box"]
+
+        else:
+            event_index = tags.index("event")
+            # Does not container an alias (e.g. springtide spring)
+            if "halloween" in tags or "festivus" in tags:
+                info = ["# Type:", f"- Event / {title(tags[event_index + 1])} {tags[event_index + 2]}",
+                        "# Cost:", "- During event only"]
+            else:
+                info = ["# Type:", f"- Event / {title(tags[event_index + 1])} {tags[event_index + 3]}",
+                        "# Cost:", "- During event only"]
+
+    # Malformed tags, don't fail the whole catalogue over one frame
+    except (IndexError, ValueError):
+        info = ["# Type:", "- Unknown"]
+
+    return "\n".join(f"{line: <27}" for line in info)
+
+
+# Frame catalogue with a tag -> frame id index
+class FrameCatalogue:
+
+    def __init__(self, frames):
+
+        # Frame ids are positions in self.frames, which is only ever appended to
+        self.frames = []
+        self.keys = []
+        self.order = []
+        self.tags = {}
+        # Typo tolerant lookup over the tag vocabulary, frame name words included
+        self.vocabulary = FuzzyIndex()
+        # Shared by every listing of the whole catalogue, replaced on add
+        self.ordered = ()
+
+        # Prebuilt frame shop fragments
+        self.names = []
+        self.info = []
+        self.images = []
+
+        for frame in frames:
+            self._add(frame)
+        self.order = sorted(range(len(self.frames)), key=self.keys.__getitem__)
+        self.ordered = tuple(self.order)
+
+    def __len__(self):
+
+        return len(self.frames)
+
+    def add(self, frame):
+
+        frame_id = self._add(frame)
+        insort(self.order, frame_id, key=self.keys.__getitem__)
+        self.ordered = tuple(self.order)
+
+        return frame_id
+
+    def _add(self, frame):
+
+        frame_id = len(self.frames)
+        self.frames.append(frame)
+        # Ties keep insertion order, same as a stable sort by name
+        self.keys.append((frame["name"], frame_id))
+
+        for tag in frame["tags"]:
+            self.tags.setdefault(tag, set()).add(frame_id)
+            self.vocabulary.add(tag)
+
+        self.names.append(title(frame["name"]))
+        self.info.append(_info_block(frame["tags"]))
+        self.images.append(IMAGE_URL.format(frame["url"]))
+
+        return frame_id
+
+    # All frames sorted by name
+    def all(self):
+
+        return [self.frames[frame_id] for frame_id in self.ordered]
+
+    # Frame ids with all tag words in the tag phrase, sorted by name
+    def search(self, possible_tags: str):
+
+        words = {word.lower() for word in possible_tags.split()}
+        if len(words) == 0:
+            return self.ordered
+
+        postings = []
+        for word in words:
+            if word not in self.tags:
+                return ()
+            postings.append(self.tags[word])
+
+        # Intersect from the smallest posting set up
+        postings.sort(key=len)
+        frame_ids = postings[0].intersection(*postings[1:])
+
+        return tuple(sorted(frame_ids, key=self.keys.__getitem__))
+
+    # Tag phrase with unknown words swapped for the closest tag, words with no close tag are kept
+    def correct(self, possible_tags: str):
+
+        return " ".join(self.vocabulary.correct(word) or word for word in possible_tags.lower().split())
+
+    # Tag phrases that match frames, each with one unknown word swapped for a close tag
+    def suggest(self, possible_tags: str, limit=3):
+
+        words = possible_tags.lower().split()
+        suggestions = []
+        for i, word in enumerate(words):
+            if word in self.tags:
+                continue
+
+            for tag in self.vocabulary.suggest(word, limit):
+                suggestion = " ".join(words[:i] + [tag] + words[i + 1:])
+                if suggestion not in suggestions and len(self.search(suggestion)) != 0:
+                    suggestions.append(suggestion)
+
+        return suggestions[:limit]
+
+    def filter_ids(self, possible_tags: str):
+
+        frame_ids = self.search(possible_tags)
+
+        # Invalid tag
+        if len(frame_ids) == 0:
+            return False, self.ordered
+
+        return True, frame_ids
+
+    def filter(self, possible_tags: str):
+
+        valid_tag, frame_ids = self.filter_ids(possible_tags)
+
+        return valid_tag, [self.frames[frame_id] for frame_id in frame_ids]
+
+
+# Frames snapshot plus an append-only journal of frames added since
+class FrameJournal:
+
+    def __init__(self, file="frames"):
+
+        self.snapshot_path = f"data/jsons/{file}.json"
+        self.journal_path = f"data/jsons/{file}.journal"
+        # Journal being compacted into the snapshot
+        self.compacting_path = f"{self.journal_path}.old"
+        self.pending = 0
+
+    def _read_journal(self, path):
+
+        if not exists(path):
+            return []
+        with open(path, "r") as journal_file:
+            return [loads(line) for line in journal_file if line.strip()]
+
+    def load(self):
+
+        with open(self.snapshot_path, "r") as snapshot_file:
+            frames = loads(snapshot_file.read())
+
+        # A crash mid compaction can leave journaled frames in the snapshot too
+        journaled = self._read_journal(self.compacting_path) + self._read_journal(self.journal_path)
+        frames += [frame for frame in journaled if frame not in frames]
+        self.pending = len(journaled)
+
+        return frames
+
+    async def append(self, frame):
+
+        async with aopen(self.journal_path, "a") as journal_file:
+            await journal_file.write(dumps(frame, escape_forward_slashes=False) + "\n")
+        self.pending += 1
+
+    # Frames must be captured before awaiting, so later appends land in the new journal
+    async def compact(self, frames):
+
+        if self.pending == 0:
+            return
+
+        if exists(self.journal_path):
+            # Left over from an interrupted compaction, keep its frames too
+            if exists(self.compacting_path):
+                with open(self.compacting_path, "a") as old_file, open(self.journal_path, "r") as journal_file:
+                    old_file.write(journal_file.read())
+                remove(self.journal_path)
+            else:
+                replace(self.journal_path, self.compacting_path)
+        self.pending = 0
+
+        async with aopen(f"{self.snapshot_path}.tmp", "w") as snapshot_file:
+            await snapshot_file.write(dumps(frames, indent=2, escape_forward_slashes=False))
+        replace(f"{self.snapshot_path}.tmp", self.snapshot_path)
+
+        if exists(self.compacting_path):
+            remove(self.compacting_path)
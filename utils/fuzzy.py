@@ -0,0 +1,98 @@
+MAX_DISTANCE = 2
+
+
+# Every string reachable by deleting up to distance characters, the word itself included
+def _deletes(word, distance):
+
+    deletes = {word}
+    level = {word}
+    for _ in range(distance):
+        level = {part[:i] + part[i + 1:] for part in level if len(part) > 1 for i in range(len(part))}
+        deletes |= level
+
+    return deletes
+
+
+# Optimal string alignment distance, anything over limit is reported as limit + 1
+def edit_distance(first, second, limit=MAX_DISTANCE):
+
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+
+    before = None
+    previous = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (first[i - 1] != second[j - 1]))
+            # Swapped neighbouring letters count as one edit
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+
+    return previous[-1]
+
+
+# Symmetric deletion index over a word vocabulary, any two words within max_distance share a deletion
+class FuzzyIndex:
+
+    def __init__(self, words=(), max_distance=MAX_DISTANCE):
+
+        self.max_distance = max_distance
+        # Word -> times added, breaks ties between equally close words
+        self.words = {}
+        # Deletion -> words it was made from
+        self.deletes = {}
+
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+
+        return len(self.words)
+
+    def __contains__(self, word):
+
+        return word in self.words
+
+    def add(self, word):
+
+        if word not in self.words:
+            self.words[word] = 0
+            for delete in _deletes(word, self.max_distance):
+                self.deletes.setdefault(delete, set()).add(word)
+        self.words[word] += 1
+
+    # (distance, word) of vocabulary words within max_distance, closest and most common first
+    def matches(self, word, max_distance=None):
+
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+
+        candidates = set()
+        for delete in _deletes(word, max_distance):
+            candidates |= self.deletes.get(delete, set())
+
+        matches = []
+        for candidate in candidates:
+            distance = edit_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, candidate))
+
+        matches.sort(key=lambda match: (match[0], -self.words[match[1]], match[1]))
+        return matches
+
+    # Closest word if the word is close enough to be a typo, short words have less room for typos
+    def correct(self, word):
+
+        if word in self.words:
+            return word
+
+        matches = self.matches(word, 0 if len(word) <= 3 else 1 if len(word) <= 6 else 2)
+        return matches[0][1] if len(matches) != 0 else None
+
+    def suggest(self, word, limit=3):
+
+        return [candidate for _, candidate in self.matches(word)[:limit]]
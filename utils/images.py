@@ -0,0 +1,80 @@
+from collections import OrderedDict
+
+from PIL import Image
+
+FRAME_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def load_frame(url):
+
+    with Image.open(f"data/frames/{url}.png") as frame:
+        return frame.convert("RGBA")
+
+
+def image_bytes(image):
+
+    return image.width * image.height * 4
+
+
+# LRU cache of decoded frames, bounded by decoded size
+class FrameImageCache:
+
+    def __init__(self, max_bytes=FRAME_CACHE_BYTES, loader=load_frame, sizeof=image_bytes):
+
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # URL -> (decoded frame, size)
+        self.images = OrderedDict()
+
+    def __len__(self):
+
+        return len(self.images)
+
+    def get(self, url):
+
+        if url in self.images:
+            self.hits += 1
+            self.images.move_to_end(url)
+            return self.images[url][0]
+
+        self.misses += 1
+        image = self.loader(url)
+        image_size = self.sizeof(image)
+
+        # Too big to ever fit, don't flush the cache for it
+        if image_size > self.max_bytes:
+            return image
+
+        self.images[url] = (image, image_size)
+        self.size += image_size
+        while self.size > self.max_bytes:
+            _, (_, old_size) = self.images.popitem(last=False)
+            self.size -= old_size
+
+        return image
+
+    def invalidate(self, url):
+
+        if url in self.images:
+            _, image_size = self.images.pop(url)
+            self.size -= image_size
+
+    def clear(self):
+
+        self.images.clear()
+        self.size = 0
+
+    def stats(self):
+
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.images),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,52 @@
+# Schema migrations for each database in data/sqlite3s, in order
+# Applied migrations are recorded in schema_version, never edit one that has shipped, add a new one instead
+
+# Role columns of the original clanverify table, in rank order
+_CLAN_ROLE_COLUMNS = (
+    "general_role_1", "general_role_2", "tairo_role", "roju_role", "ometsuke_role", "daimyo_role", "gundai_role",
+    "monogashiro_role", "ashigaru_role", "chonin_role")
+
+MIGRATIONS = {
+    "clanverify": [
+
+        # 1: Original table
+        ["""
+        CREATE TABLE IF NOT EXISTS clanverify (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            general_role_1 INTEGER,
+            general_role_2 INTEGER,
+            tairo_role INTEGER,
+            roju_role INTEGER,
+            ometsuke_role INTEGER,
+            daimyo_role INTEGER,
+            gundai_role INTEGER,
+            monogashiro_role INTEGER,
+            ashigaru_role INTEGER,
+            chonin_role INTEGER)"""],
+
+        # 2: Every clan command looks clans up by guild
+        ["CREATE INDEX IF NOT EXISTS clanverify_guild_id ON clanverify (guild_id)"],
+
+        # 3: Roles move to their own table, one row per set role
+        ["""
+        CREATE TABLE clanroles (
+            clan_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            role_id INTEGER NOT NULL,
+            PRIMARY KEY (clan_id, rank)) WITHOUT ROWID"""] +
+        [f"INSERT INTO clanroles (clan_id, rank, role_id) SELECT id, {rank}, {column} FROM clanverify "
+         f"WHERE {column} != 0" for rank, column in enumerate(_CLAN_ROLE_COLUMNS)] +
+        ["CREATE TABLE clanverify_new (id INTEGER PRIMARY KEY, guild_id INTEGER)",
+         "INSERT INTO clanverify_new (id, guild_id) SELECT id, guild_id FROM clanverify",
+         "DROP TABLE clanverify",
+         "ALTER TABLE clanverify_new RENAME TO clanverify",
+         "CREATE INDEX clanverify_guild_id ON clanverify (guild_id)",
+         """
+         CREATE TRIGGER clanverify_delete AFTER DELETE ON clanverify BEGIN
+             DELETE FROM clanroles WHERE clan_id = OLD.id;
+         END""",
+         # Same columns as the original table, 0 for roles that aren't set
+         "CREATE VIEW clanverify_roles AS SELECT id, guild_id, " + ", ".join(
+             f"COALESCE((SELECT role_id FROM clanroles WHERE clan_id = clanverify.id AND rank = {rank}), 0) "
+             f"AS {column}" for rank, column in enumerate(_CLAN_ROLE_COLUMNS)) + " FROM clanverify"]]}
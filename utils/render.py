@@ -0,0 +1,211 @@
+from asyncio import Semaphore
+from asyncio import TimeoutError
+from asyncio import get_running_loop
+from asyncio import wait_for
+from asyncio import wrap_future
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from os import cpu_count
+from os import getpid
+from signal import ITIMER_REAL
+from signal import SIGALRM
+from signal import setitimer
+from signal import signal
+from time import monotonic
+
+from PIL import Image
+
+from utils.atlas import FrameAtlas
+from utils.atlas import get_atlas_frame
+from utils.composite import CHARACTER
+from utils.composite import composite_frames
+from utils.composite import frame_arrays
+
+# Grid cell of each frame, and grid size for each frame count
+PLACEMENT = ((0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1), (3, 0), (3, 1), (4, 0), (4, 1))
+SIZE = ((1, 1), (2, 1), (3, 1), (3, 2), (3, 2), (3, 2), (4, 2), (4, 2), (5, 2), (5, 2))
+# Extra time the event loop gives a job before giving up on it, in case the worker's own timer can't fire
+TIMEOUT_GRACE = 5.0
+
+# Frames read from the atlas and frames decoded instead by this worker process
+_frame_reads = {"atlas_reads": 0, "fallbacks": 0}
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+def _timed_out(signum, frame):
+
+    raise TimeoutError("Render took too long")
+
+
+# Composite the character into each frame, runs inside a worker process
+# Jobs over the timeout raise TimeoutError in the worker, so only that job fails and the worker is free again
+def render_frames(character: bytes, generation: int, frames: tuple, file_format="JPEG", timeout=None):
+
+    if timeout is None:
+        return _render_frames(character, generation, frames, file_format)
+
+    signal(SIGALRM, _timed_out)
+    setitimer(ITIMER_REAL, timeout)
+    try:
+        return _render_frames(character, generation, frames, file_format)
+    finally:
+        setitimer(ITIMER_REAL, 0)
+
+
+def _render_frames(character, generation, frames, file_format):
+
+    fallbacks = sum(record is None for _, record in frames)
+    _frame_reads["atlas_reads"] += len(frames) - fallbacks
+    _frame_reads["fallbacks"] += fallbacks
+
+    character = Image.open(BytesIO(character)).resize(CHARACTER)
+    result = composite_frames(
+        character,
+        # Frames missing from the atlas are decoded and cached by the worker
+        [frame_arrays.get(url) if record is None else get_atlas_frame(generation, record) for url, record in frames],
+        SIZE[len(frames) - 1], PLACEMENT[:len(frames)])
+
+    buffer = BytesIO()
+    result.save(buffer, format=file_format)
+
+    return buffer.getvalue(), getpid(), {**frame_arrays.stats(), **_frame_reads}
+
+
+# LRU cache of encoded renders with a time to live
+class ResultCache:
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=600.0):
+
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Key -> (expiry, data)
+        self.results = OrderedDict()
+
+    def _pop(self, key):
+
+        _, data = self.results.pop(key)
+        self.size -= len(data)
+
+    def get(self, key):
+
+        if key in self.results:
+            expiry, data = self.results[key]
+            if expiry > monotonic():
+                self.hits += 1
+                self.results.move_to_end(key)
+                return data
+            self._pop(key)
+
+        self.misses += 1
+        return None
+
+    def set(self, key, data):
+
+        if len(data) > self.max_bytes:
+            return
+        if key in self.results:
+            self._pop(key)
+
+        self.results[key] = (monotonic() + self.ttl, data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self.results)))
+
+
+# Process pool for frame test rendering
+class RenderEngine:
+
+    def __init__(self, workers=None, max_jobs=32, timeout=15.0):
+
+        self.workers = workers or cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        # Jobs waiting for a worker or running, until the worker is done with them even if their caller isn't
+        self.jobs = 0
+        # One per worker, jobs are only submitted once a worker is free so their timeout is all render time
+        self.slots = Semaphore(self.workers)
+        # Worker pid -> stats of its frame cache and atlas reads, from its latest render
+        self.worker_stats = {}
+        self.atlas = FrameAtlas()
+        self.results = ResultCache()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    # Digest is the character image's content hash, renders are only cached when given
+    async def render(self, character: bytes, urls, file_format="JPEG", digest=None):
+
+        # Overwritten frames get a new atlas record, so stale renders are never hit
+        generation, frames = self.atlas.lookup(urls)
+        key = (digest, generation, frames, file_format)
+
+        if digest is not None:
+            data = self.results.get(key)
+            if data is not None:
+                return data
+
+        if self.jobs >= self.max_jobs:
+            raise RenderQueueFull
+
+        self.jobs += 1
+        try:
+            await self.slots.acquire()
+        except BaseException:
+            self.jobs -= 1
+            raise
+
+        loop = get_running_loop()
+        job = self.executor.submit(render_frames, character, generation, frames, file_format, self.timeout)
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._finish_job))
+
+        # The worker's timer fails the job, this only stops waiting on one stuck where the timer can't fire,
+        # the job still holds its slot until it finishes
+        data, pid, worker_stats = await wait_for(wrap_future(job), self.timeout + TIMEOUT_GRACE)
+
+        self.worker_stats[pid] = worker_stats
+        if digest is not None:
+            self.results.set(key, data)
+
+        return data
+
+    def _finish_job(self):
+
+        self.jobs -= 1
+        self.slots.release()
+
+    # Preprocess every frame missing from the atlas, off the event loop
+    async def build_atlas(self, urls):
+
+        await get_running_loop().run_in_executor(None, self.atlas.build, urls)
+
+    # Frame image was added or overwritten
+    async def update_atlas(self, url):
+
+        await get_running_loop().run_in_executor(None, self.atlas.update, url)
+
+    def stats(self):
+
+        return {
+            "workers": self.workers,
+            "jobs": self.jobs,
+            "max_jobs": self.max_jobs,
+            "atlas_frames": len(self.atlas.frames),
+            "atlas_bytes": self.atlas.size,
+            "atlas_reads": sum(stats["atlas_reads"] for stats in self.worker_stats.values()),
+            "atlas_fallbacks": sum(stats["fallbacks"] for stats in self.worker_stats.values()),
+            "frame_entries": sum(stats["entries"] for stats in self.worker_stats.values()),
+            "frame_bytes": sum(stats["bytes"] for stats in self.worker_stats.values()),
+            "frame_hits": sum(stats["hits"] for stats in self.worker_stats.values()),
+            "frame_misses": sum(stats["misses"] for stats in self.worker_stats.values()),
+            "result_entries": len(self.results.results),
+            "result_hits": self.results.hits,
+            "result_misses": self.results.misses}
+
+    def close(self):
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
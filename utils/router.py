@@ -0,0 +1,96 @@
+from asyncio import Queue
+from asyncio import get_running_loop
+from asyncio import wait_for
+from contextlib import contextmanager
+from re import compile
+
+mention_pattern = compile(r"<@!?(\d+)>")
+
+
+# Routes incoming messages to waiting sessions by (channel id, user id), and message edits by message id
+class MessageRouter:
+
+    def __init__(self, bot):
+
+        self.bot = bot
+        # (channel id, user id or None for any author) -> [(future, check)]
+        self.sessions = {}
+        # Message id -> [queue of edit payloads]
+        self.edits = {}
+
+    def __len__(self):
+
+        return sum(len(sessions) for sessions in (*self.sessions.values(), *self.edits.values()))
+
+    def _keys(self, message):
+
+        channel_id = message.channel.id
+        keys = [(channel_id, message.author.id), (channel_id, None)]
+
+        # Bot messages starting with a ping go to the pinged user's sessions
+        if self.bot.user is not None and message.author.id == self.bot.user.id:
+            mention = mention_pattern.match(message.content)
+            if mention is not None:
+                keys.append((channel_id, int(mention.group(1))))
+
+        return keys
+
+    @staticmethod
+    def _resolve(sessions, item):
+
+        for session in sessions.copy():
+            future, check = session
+            if future.done():
+                continue
+
+            try:
+                result = check is None or check(item)
+            except Exception as err:
+                future.set_exception(err)
+            else:
+                if result:
+                    future.set_result(item)
+
+    @staticmethod
+    async def _wait(sessions, key, check, timeout):
+
+        session = (get_running_loop().create_future(), check)
+        sessions.setdefault(key, []).append(session)
+
+        try:
+            return await wait_for(session[0], timeout)
+        finally:
+            sessions[key].remove(session)
+            if len(sessions[key]) == 0:
+                del sessions[key]
+
+    def dispatch(self, message):
+
+        for key in self._keys(message):
+            if key in self.sessions:
+                self._resolve(self.sessions[key], message)
+
+    # Raw edit payloads, so edits to messages outside the message cache are seen too
+    def dispatch_edit(self, payload):
+
+        for edits in self.edits.get(payload.message_id, ()):
+            edits.put_nowait(payload)
+
+    # Wait for a message in the channel from the user, or from anyone if user_id is None
+    async def wait_for(self, channel_id, user_id=None, check=None, timeout=None):
+
+        return await self._wait(self.sessions, (channel_id, user_id), check, timeout)
+
+    # Every edit of the message is queued while subscribed, including ones made while the subscriber is busy
+    @contextmanager
+    def subscribe_edits(self, message_id):
+
+        edits = Queue()
+        self.edits.setdefault(message_id, []).append(edits)
+
+        try:
+            yield edits
+        finally:
+            self.edits[message_id].remove(edits)
+            if len(self.edits[message_id]) == 0:
+                del self.edits[message_id]
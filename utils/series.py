@@ -0,0 +1,97 @@
+from collections import deque
+
+SERIES_CACHE_SIZE = 4096
+
+
+# Clean series table lookups, keys starting with * are replaced anywhere inside a series name
+class SeriesCleaner:
+
+    def __init__(self, clean_series):
+
+        self.build(clean_series)
+
+    # Rebuilt whenever the clean series table changes
+    def build(self, clean_series):
+
+        self.clean_series = clean_series
+        self.exact = {}
+        self.substrings = {}
+        for before, after in clean_series.items():
+            if before.startswith("*"):
+                if len(before) > 1:
+                    self.substrings[before[1:]] = after
+            else:
+                self.exact[before] = after
+        # Series name -> cleaned name
+        self.cache = {}
+
+        # Aho-Corasick automaton over the substring rules, state 0 is the root
+        self.goto = [{}]
+        self.fail = [0]
+        # Rules ending at each state, including those reached through fail links
+        self.output = [()]
+
+        for pattern in self.substrings:
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = self.goto[state][char]
+            self.output[state] = (pattern,)
+
+        queue = deque(self.goto[0].values())
+        while len(queue) != 0:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback != 0 and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                if state != 0:
+                    self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] += self.output[self.fail[child]]
+                queue.append(child)
+
+    # Leftmost longest substring rules, without overlaps
+    def _replace(self, series):
+
+        matches = []
+        state = 0
+        for end, char in enumerate(series, 1):
+            while state != 0 and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern in self.output[state]:
+                matches.append((end - len(pattern), -len(pattern), pattern))
+
+        if len(matches) == 0:
+            return series
+
+        matches.sort()
+        parts = []
+        position = 0
+        for start, _, pattern in matches:
+            if start >= position:
+                parts += [series[position:start], self.substrings[pattern]]
+                position = start + len(pattern)
+        parts.append(series[position:])
+
+        return "".join(parts)
+
+    def clean(self, series):
+
+        if series in self.exact:
+            return self.exact[series]
+        if series in self.cache:
+            return self.cache[series]
+
+        cleaned = self._replace(series)
+        cleaned = self.exact.get(cleaned, cleaned)
+
+        if len(self.cache) >= SERIES_CACHE_SIZE:
+            self.cache.clear()
+        self.cache[series] = cleaned
+
+        return cleaned